@@ -0,0 +1,420 @@
+"""
+
+#
+#   Benchmarks for the collection, decode, validation and log parsing
+#
+#   Everything runs on made up data so no radio is needed: scans come
+#   from packet_sources.SyntheticSource and logs are written in the
+#   format thermoBeacon prints. Sizes scale with the number of sensors,
+#   packets per scan and records per log.
+#
+#   Lexing and each stage of thermoBeacon.decode_scan() are timed on their own, as
+#   are the scalar interpret() it replaced, the streaming ScanAggregator
+#   and replaying a scan through packet_sources.collect(). Then
+#   parse_brifit on logs of increasing length.
+#
+#   Results go out as JSON (stdout or a file) so runs on different
+#   versions can be compared:
+#
+#       python3 benchmark.py --output before.json
+#       ... change things ...
+#       python3 benchmark.py --output after.json --compare before.json
+#
+#   Options (lists are comma separated):
+#       --sensors 4,16,64       sensors in a scan
+#       --packets 1000,10000    packets per scan
+#       --records 1000,10000,100000,1000000   records per log
+#       --repeats 3             best of this many runs
+#
+
+"""
+
+import asyncio
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import numpy
+
+import thermoBeacon
+import parse_brifit
+import btcapture
+import packet_sources
+import btlexer
+
+sensors = [4, 16, 64]
+packets = [1000, 10000]
+records = [1000, 10000, 100000]
+repeats = 3
+
+
+#
+#   Data generators
+#
+
+
+#   The lines bluetoothctl would print for a scan of sensors thermometers
+#   sending packets advertisements between them
+
+
+def synthetic_scan(sensors, packets, seed=0):
+    source = packet_sources.SyntheticSource(sensors, None, packets, seed=seed)
+
+    async def gather():
+        return [line async for line in source.lines()]
+
+    return asyncio.run(gather())
+
+
+#   Names for the synthetic thermometers, so results come out as locations
+
+
+def name_sensors(sensors):
+    source = packet_sources.SyntheticSource(sensors)
+    for number, mac in enumerate(source.macs):
+        thermoBeacon.MACLocations.setdefault(mac, "Sensor%d" % number)
+
+
+#   A log of records reports from sensors thermometers half an hour apart,
+#   with the odd failed scan and both forms of date in it
+
+
+def synthetic_log(filename, records, sensors=4, seed=0):
+    generator = random.Random(seed)
+    when = datetime.datetime(2023, 1, 26, 17, 5, 3)
+    names = ["Sensor%d" % number for number in range(sensors)]
+
+    with open(filename, "w") as handle:
+        for record in range(records):
+            when += datetime.timedelta(seconds=1800 + generator.randint(0, 30))
+
+            if generator.random() < 0.01:
+                handle.write("No temperature data in scan\n\n")
+                continue
+
+            results = []
+            for name in names:
+                temp = round(generator.uniform(-5.0, 25.0), 2)
+                humid = round(generator.uniform(20.0, 99.0), 2)
+                results.append(
+                    (
+                        name,
+                        temp,
+                        humid,
+                        round(generator.uniform(0.0, 1.5), 2),
+                        round(generator.uniform(-10.0, 15.0), 2),
+                        round(temp - generator.uniform(0.0, 2.0), 2),
+                        round(generator.uniform(2.5, 3.0), 2),
+                    )
+                )
+
+            if record % 50 == 0:
+                stamp = when.strftime("%a %d %b %H:%M:%S GMT %Y")
+            else:
+                stamp = str(when) + " "
+            handle.write(stamp + " Data: " + str(results) + "\n")
+
+
+#
+#   Timing
+#
+
+
+#   Best of repeats runs of work(prepare()), prepare not being timed.
+#   Returns seconds and the last result
+
+
+def best(work, prepare=lambda: None, repeats=None):
+    if repeats is None:
+        repeats = globals()["repeats"]
+
+    fastest = None
+    for run in range(repeats):
+        given = prepare()
+        start = time.perf_counter()
+        result = work(given)
+        taken = time.perf_counter() - start
+        if fastest is None or taken < fastest:
+            fastest = taken
+
+    return fastest, result
+
+
+def entry(stage, seconds, items, **sizes):
+    result = {"stage": stage, "seconds": seconds, "items": items}
+    result.update(sizes)
+    if items:
+        result["us_per_item"] = seconds * 1e6 / items
+    return result
+
+
+#
+#   The decode stages one after another on one scan, each fed what
+#   the stage before produced
+#
+
+
+def bench_scan(sensors, packets):
+    name_sensors(sensors)
+    scan = synthetic_scan(sensors, packets)
+    sizes = {"sensors": sensors, "packets": packets, "lines": len(scan)}
+    results = []
+
+    #   Lexing on its own, then as part of sorting the lines out
+
+    seconds, events = best(lambda given: [btlexer.lex(line) for line in scan])
+    results.append(entry("lex", seconds, len(scan), **sizes))
+
+    #   Signal strengths are only kept when asked for, so ask here
+    #   to give rssi_summary something to do. The other stages are
+    #   timed as a run without findRssi would be
+
+    findRssi = thermoBeacon.findRssi
+    thermoBeacon.findRssi = True
+    seconds, classified = best(thermoBeacon.classify_scan, lambda: list(scan))
+    thermoBeacon.findRssi = findRssi
+    results.append(entry("classify_scan", seconds, len(scan), **sizes))
+    thermometers, thermometerRSSI, hexlines = classified
+
+    seconds, stats = best(
+        lambda given: thermoBeacon.rssi_summary(thermometers, thermometerRSSI)
+    )
+    results.append(entry("rssi_summary", seconds, len(thermometerRSSI), **sizes))
+
+    seconds, dataforMAC = best(
+        lambda given: thermoBeacon.match_macs(thermometers, hexlines)
+    )
+    results.append(entry("match_macs", seconds, len(hexlines), **sizes))
+
+    seconds, datums = best(
+        lambda given: [thermoBeacon.interpret(record, False) for record in dataforMAC]
+    )
+    results.append(entry("interpret", seconds, len(dataforMAC), **sizes))
+
+    seconds, datums = best(lambda given: thermoBeacon.decode_batch(dataforMAC))
+    results.append(entry("decode_batch", seconds, len(dataforMAC), **sizes))
+
+    seconds, range_checked = best(lambda given: thermoBeacon.range_check(datums))
+    results.append(entry("range_check", seconds, len(datums), **sizes))
+
+    seconds, deduplicated = best(lambda given: thermoBeacon.deduplicate(range_checked))
+    results.append(entry("deduplicate", seconds, len(range_checked), **sizes))
+    range_checked = deduplicated[0]
+
+    seconds, validated = best(
+        lambda given: thermoBeacon.counter_check(thermometers, range_checked)
+    )
+    results.append(entry("counter_check", seconds, len(range_checked), **sizes))
+
+    seconds, averages = best(
+        lambda given: thermoBeacon.average(thermometers, validated)
+    )
+    results.append(entry("average", seconds, len(validated), **sizes))
+
+    #   The whole lot, batch and streaming
+
+    seconds, decoded = best(thermoBeacon.decode_scan, lambda: list(scan))
+    results.append(entry("decode_scan", seconds, len(scan), **sizes))
+
+    def stream(given):
+        aggregator = thermoBeacon.ScanAggregator()
+        for line in scan:
+            aggregator.feed(line)
+        return aggregator.validate()
+
+    seconds, streamed = best(stream)
+    results.append(entry("ScanAggregator", seconds, len(scan), **sizes))
+
+    #   Saved as a capture then replayed, a line at a time as
+    #   bluetoothctl would have printed it and straight from the records
+
+    with tempfile.TemporaryDirectory() as directory:
+        capture = os.path.join(directory, "scan.btc")
+        saver = thermoBeacon.ScanAggregator()
+        saver.capture = btcapture.CaptureWriter(capture)
+        for line in scan:
+            saver.feed(line)
+        saver.capture.close()
+        count = len(btcapture.read(capture))
+
+        def replay_lines(given):
+            aggregator = thermoBeacon.ScanAggregator()
+            for line in packet_sources.capture_lines(capture):
+                aggregator.feed(line)
+            return aggregator.validate()
+
+        seconds, replayed = best(replay_lines)
+        results.append(entry("capture_lines", seconds, count, **sizes))
+
+        def replay_records(given):
+            aggregator = thermoBeacon.ScanAggregator()
+            aggregator.feed_capture(capture)
+            return aggregator.validate()
+
+        seconds, replayed = best(replay_records)
+        results.append(entry("feed_capture", seconds, count, **sizes))
+
+        seconds, datums = best(
+            lambda given: thermoBeacon.decode_capture(btcapture.read(capture))
+        )
+        results.append(entry("decode_capture", seconds, count, **sizes))
+
+    #   Through the asyncio queue as a live scan would be
+
+    def replay(given):
+        aggregator = thermoBeacon.ScanAggregator()
+        source = packet_sources.SyntheticSource(sensors, None, packets)
+        return asyncio.run(packet_sources.collect(source, aggregator.feed, 3600.0))
+
+    seconds, count = best(replay)
+    results.append(entry("collect_synthetic", seconds, count, **sizes))
+
+    return results
+
+
+#
+#   parse_brifit on a log of records reports
+#
+
+
+def bench_log(directory, records):
+    filename = os.path.join(directory, "tempBT%d.txt" % records)
+    synthetic_log(filename, records)
+    sizes = {"records": records, "bytes": os.path.getsize(filename)}
+    results = []
+
+    seconds, table = best(lambda given: parse_brifit.loadall(filename))
+    results.append(entry("loadall", seconds, records, **sizes))
+
+    def massage(given):
+        with contextlib.redirect_stdout(io.StringIO()):
+            try:
+                parse_brifit.massagerawdata(filename, 1, False, 10)
+            except SystemExit:
+                pass
+
+    seconds, table = best(massage)
+    results.append(entry("massagerawdata", seconds, records, **sizes))
+
+    seconds, table = best(lambda given: parse_brifit.loadall(filename, "tail", 10))
+    results.append(entry("loadall_tail", seconds, 10, **sizes))
+
+    os.remove(filename)
+
+    return results
+
+
+def run():
+    results = []
+
+    for count in sensors:
+        for number in packets:
+            results += bench_scan(count, number)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for number in records:
+            results += bench_log(directory, number)
+
+    return {
+        "when": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+
+#   How each stage compares to an earlier run, slower is > 1.0
+
+
+def compare(current, previous):
+    def key(result):
+        return tuple(
+            (name, value)
+            for name, value in sorted(result.items())
+            if name not in ("seconds", "us_per_item", "bytes", "items")
+        )
+
+    before = {key(result): result["seconds"] for result in previous["results"]}
+
+    for result in current["results"]:
+        old = before.get(key(result))
+        if old is None or old == 0.0:
+            continue
+        sizes = ", ".join(
+            "%s %s" % (name, value) for name, value in key(result) if name != "stage"
+        )
+        print(
+            result["stage"].ljust(20),
+            sizes.ljust(40),
+            "%.2f" % (result["seconds"] / old),
+            file=sys.stderr,
+        )
+
+
+def usage():
+    print(
+        "Usage: benchmark.py [--sensors N,..] [--packets N,..] [--records N,..]"
+        " [--repeats N] [--output file.json] [--compare earlier.json]"
+    )
+
+
+def main():
+    global sensors, packets, records, repeats
+
+    args = sys.argv[1:]
+    output = None
+    previous = None
+
+    while args != []:
+        option = args.pop(0)
+        if args == []:
+            usage()
+            exit()
+        value = args.pop(0)
+
+        if option in ("--sensors", "--packets", "--records"):
+            try:
+                sizes = [int(size) for size in value.split(",")]
+            except ValueError:
+                usage()
+                exit()
+            if option == "--sensors":
+                sensors = sizes
+            elif option == "--packets":
+                packets = sizes
+            else:
+                records = sizes
+        elif option == "--repeats" and value.isdigit():
+            repeats = max(1, int(value))
+        elif option == "--output":
+            output = value
+        elif option == "--compare":
+            with open(value, "r") as handle:
+                previous = json.load(handle)
+        else:
+            usage()
+            exit()
+
+    current = run()
+
+    if output is None:
+        json.dump(current, sys.stdout, indent=1)
+        print()
+    else:
+        with open(output, "w") as handle:
+            json.dump(current, handle, indent=1)
+
+    if previous is not None:
+        compare(current, previous)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+
+#
+#   Compact binary capture of thermoBeacon advertising packets
+#
+#   Rather than pickle every line bluetoothctl printed (menus, colour
+#   codes and all) just the advertising events are kept: when, which
+#   MAC, its signal strength and the raw manufacturer data bytes.
+#
+#   The file is an 8 byte header followed by fixed size records so it
+#   can be appended to as packets arrive and memory mapped to read
+#   without loading the lot. A record cut short by a crash mid write
+#   is ignored.
+#
+#   Convert a pickled scan with
+#       python3 btcapture.py rawBTdata.pk rawBTdata.btc
+#
+
+"""
+
+import os
+import sys
+import numpy
+
+MAGIC = b"BTCAP\x00\x01\x00"
+
+#   Longest hex dump line bluetoothctl prints is 16 bytes, leave some room
+
+MAXBYTES = 24
+
+#   Stored when no signal strength has been seen for the MAC
+
+NORSSI = -32768
+
+RECORD = numpy.dtype(
+    [
+        ("time", "<f8"),
+        ("mac", "<u8"),
+        ("rssi", "<i2"),
+        ("length", "u1"),
+        ("data", "u1", (MAXBYTES,)),
+    ]
+)
+
+
+#   MAC string to a 48 bit number and back
+
+
+def mac_number(mac):
+    return int(mac.replace(":", ""), 16)
+
+
+def mac_name(value):
+    digits = "%012X" % value
+    return ":".join(digits[index : index + 2] for index in range(0, 12, 2))
+
+
+#   Is this file one of ours
+
+
+def is_capture(filename):
+    try:
+        with open(filename, "rb") as handle:
+            return handle.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+#   Events (time, MAC, rssi or None, bytes) as an array of records
+
+
+def to_records(events):
+    events = list(events)
+    records = numpy.zeros(len(events), dtype=RECORD)
+    for index, (when, mac, rssi, data) in enumerate(events):
+        data = bytes(data[:MAXBYTES])
+        records[index]["time"] = when
+        records[index]["mac"] = mac_number(mac)
+        records[index]["rssi"] = NORSSI if rssi is None else rssi
+        records[index]["length"] = len(data)
+        records[index]["data"][: len(data)] = numpy.frombuffer(data, numpy.uint8)
+    return records
+
+
+#
+#   Append records to a capture, writing the header if its a new file.
+#   Keep it open to add events one at a time as they arrive,
+#   or use append() to write a batch in one go
+#
+
+
+class CaptureWriter:
+    def __init__(self, filename):
+        self.handle = open(filename, "ab")
+        if self.handle.tell() == 0:
+            self.handle.write(MAGIC)
+
+    def write(self, events):
+        self.handle.write(to_records(events).tobytes())
+        self.handle.flush()
+
+    def close(self):
+        self.handle.close()
+
+
+def append(filename, events):
+    writer = CaptureWriter(filename)
+    writer.write(events)
+    writer.close()
+
+
+#   Replace a capture with just these events, all at once
+
+
+def save(filename, events):
+    temporary = filename + ".tmp"
+    with open(temporary, "wb") as handle:
+        handle.write(MAGIC)
+        handle.write(to_records(events).tobytes())
+    os.replace(temporary, filename)
+
+
+#   Memory map a capture as an array of records. Nothing is read
+#   till its used
+
+
+def read(filename):
+    if not is_capture(filename):
+        raise ValueError(filename + " is not a capture file")
+    count = (os.path.getsize(filename) - len(MAGIC)) // RECORD.itemsize
+    if count <= 0:
+        return numpy.zeros(0, dtype=RECORD)
+    return numpy.memmap(
+        filename, dtype=RECORD, mode="r", offset=len(MAGIC), shape=(count,)
+    )
+
+
+#   Iterate events (time, MAC, rssi or None, bytes) one at a time
+
+
+def events(filename):
+    return to_events(read(filename))
+
+
+def to_events(records):
+    for record in records:
+        rssi = int(record["rssi"])
+        yield (
+            float(record["time"]),
+            mac_name(int(record["mac"])),
+            None if rssi == NORSSI else rssi,
+            record["data"][: record["length"]].tobytes(),
+        )
+
+
+#   Convert a pickled scan to a capture by running it through the
+#   streaming decoder with a writer attached
+
+
+def convert(picklefile, capturefile):
+    import pickle
+    import thermoBeacon
+
+    with open(picklefile, "rb") as handle:
+        scan = pickle.load(handle)
+
+    aggregator = thermoBeacon.ScanAggregator()
+    aggregator.capture = CaptureWriter(capturefile)
+    for line in scan:
+        aggregator.feed(line)
+    aggregator.capture.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: btcapture.py pickled_scan capture_file")
+        exit()
+    convert(sys.argv[1], sys.argv[2])
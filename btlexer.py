@@ -0,0 +1,94 @@
+"""
+
+#
+#   Lexer for the lines bluetoothctl prints
+#
+#   Each line is stripped of its colour and cursor escape sequences
+#   (e.g. ESC[0;94m, ESC[K, ESC[?2004h) and readline's \x01 \x02 markers
+#   then sorted into one of
+#
+#       ANNOUNCE    a device announcing its name, e.g. [NEW] Device MAC ThermoBeacon
+#                   mac and the name as value
+#       RSSI        a device's signal strength, [CHG] Device MAC RSSI: -64
+#                   mac and the strength as value
+#       DATA        a line of hex dump (manufacturer data), value the bytes
+#                   as a list of upper case two character hex strings
+#       NOISE       anything else: menus, prompts, other properties
+#
+#   in a single pass with nothing searched for twice.
+#
+
+"""
+
+import collections
+import re
+
+ANNOUNCE = "announce"
+RSSI = "rssi"
+DATA = "data"
+NOISE = "noise"
+
+Event = collections.namedtuple("Event", ["kind", "mac", "value"])
+
+#   CSI sequences: ESC [ then parameters then a final letter
+
+ESCAPES = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")
+
+#   Readline's prompt markers and line endings just go
+
+CONTROLS = str.maketrans("", "", "\x01\x02\r\n")
+
+#   Every two character hex byte as it appears in a line, upper case
+
+HEXBYTES = frozenset("%02X" % byte for byte in range(256))
+
+
+def clean(line):
+    if "\x1b" in line:
+        line = ESCAPES.sub("", line)
+    return line.translate(CONTROLS)
+
+
+#   The run of hex bytes in a list of tokens, from the first one found.
+
+
+def hex_run(tokens):
+    for start, token in enumerate(tokens):
+        if token in HEXBYTES:
+            break
+    else:
+        return []
+
+    end = start + 1
+    while end < len(tokens) and tokens[end] in HEXBYTES:
+        end += 1
+
+    return tokens[start:end]
+
+
+def lex(line):
+    text = clean(line)
+
+    #   Device lines: Device MAC then either a property
+    #   (Name: value, ManufacturerData Key: ...) or its name
+
+    device = text.find("Device ")
+    if device != -1:
+        fields = text[device + 7 :].split(None, 1)
+        if len(fields) == 2:
+            mac = fields[0].upper()
+            rest = fields[1].strip()
+            if rest.startswith("RSSI: "):
+                try:
+                    return Event(RSSI, mac, int(rest[6:]))
+                except ValueError:
+                    pass
+            elif ":" not in rest:
+                return Event(ANNOUNCE, mac, rest)
+        return Event(NOISE, None, text)
+
+    hexes = hex_run(text.upper().split())
+    if hexes != []:
+        return Event(DATA, None, hexes)
+
+    return Event(NOISE, None, text)
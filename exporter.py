@@ -0,0 +1,167 @@
+"""
+
+#
+#   Latest readings in Prometheus text format
+#
+#   thermoBeacon hands each report's results and signal strengths here
+#   as well as printing them, so nothing has to parse the log again to
+#   find out what the temperature is. Two ways out:
+#
+#       Exporter        an HTTP server in a background thread, for the
+#                       daemon (thermoBeacon.py --daemon) which keeps
+#                       running. GET /metrics from it.
+#       write_textfile  a file for node_exporter's textfile collector,
+#                       for one shot runs from cron. Replaced in one go
+#                       so a scrape never sees half of it.
+#
+#   Sensors that got no good samples this time report up 0 and no
+#   readings rather than the -273.15 placeholder.
+#
+
+"""
+
+import os
+import threading
+import http.server
+
+PREFIX = "thermobeacon_"
+
+#   Each reading in the order thermoBeacon reports them after the location
+
+READINGS = [
+    ("temperature_celsius", "Temperature"),
+    ("humidity_percent", "Relative humidity"),
+    ("vpd_kilopascals", "Vapour pressure deficit"),
+    ("dew_point_celsius", "Dew point"),
+    ("heat_index_celsius", "Heat index"),
+    ("battery_volts", "Battery voltage"),
+]
+
+
+def escape(label):
+    return label.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+#   One metric, its help and type lines then a sample per label set
+
+
+def metric(name, help, samples, kind="gauge"):
+    lines = ["# HELP " + PREFIX + name + " " + help]
+    lines.append("# TYPE " + PREFIX + name + " " + kind)
+    for labels, value in samples:
+        text = ",".join('%s="%s"' % (key, escape(str(labels[key]))) for key in labels)
+        if text != "":
+            text = "{" + text + "}"
+        lines.append(PREFIX + name + text + " " + repr(float(value)))
+    return lines
+
+
+#
+#   The exposition text for one report.
+#   results and rssi_stats as thermoBeacon.report() gets them, stats a
+#   RunStats.record() (or None) for scan duration and packet counts,
+#   when the time of the report in seconds since the epoch
+#
+
+
+def format_metrics(results, rssi_stats, stats=None, when=None):
+    up = []
+    readings = [[] for reading in READINGS]
+    for result in sorted(results):
+        labels = {"location": result[0]}
+        failed = result[2] == -273.15
+        up.append((labels, 0 if failed else 1))
+        if failed:
+            continue
+        for index, value in enumerate(result[1:7]):
+            readings[index].append((labels, value))
+
+    lines = metric("up", "Sensor had good samples in the last scan", up)
+    for (name, help), samples in zip(READINGS, readings):
+        lines += metric(name, help, samples)
+
+    if rssi_stats != []:
+        samples = []
+        for location, low, average, high in sorted(rssi_stats):
+            for stat, value in (("min", low), ("mean", average), ("max", high)):
+                samples.append(({"location": location, "stat": stat}, value))
+        lines += metric("rssi_dbm", "Signal strength over the scan", samples)
+
+    if stats is not None:
+        lines += metric(
+            "scan_seconds", "How long the last scan took", [({}, stats["seconds"])]
+        )
+        lines += metric(
+            "lines_read",
+            "Lines read from bluetoothctl in the last scan",
+            [({}, stats["counts"].get("lines_read", 0))],
+        )
+        for count, help in (
+            ("packets", "ManufacturerData records in the last scan"),
+            ("samples", "Samples passing the checks in the last scan"),
+        ):
+            samples = [
+                ({"location": location}, counts[count])
+                for location, counts in sorted(stats["sensors"].items())
+            ]
+            lines += metric(count, help, samples)
+
+    if when is not None:
+        lines += metric(
+            "last_report_timestamp_seconds",
+            "When the last report was made",
+            [({}, when)],
+        )
+
+    return "\n".join(lines) + "\n"
+
+
+#   Replace filename with text, all at once
+
+
+def write_textfile(filename, text):
+    temporary = filename + ".tmp"
+    with open(temporary, "w") as handle:
+        handle.write(text)
+    os.replace(temporary, filename)
+
+
+#
+#   Serve the latest text on address:port until the process ends.
+#   update() whenever there's a new report
+#
+
+
+class Exporter:
+    def __init__(self, port, address="127.0.0.1"):
+        self.text = ""
+        self.lock = threading.Lock()
+        exporter = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                with exporter.lock:
+                    body = exporter.text.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # stdout is the log, keep it for Data: records
+
+        self.server = http.server.ThreadingHTTPServer((address, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def update(self, text):
+        with self.lock:
+            self.text = text
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,312 @@
+"""
+
+#
+#   Rotated and compressed segments of the text log
+#
+#   tempBT.txt only ever grows. rotate() seals it off when it gets
+#   bigger than rotateBytes: older segments move up a number, the log
+#   becomes tempBT.txt.1 compressed (tempBT.txt.1.gz by default, .xz or
+#   .zst if zstandard is installed) and logBT starts a new tempBT.txt.
+#   Numbered segments are sealed and higher numbers are older. This
+#   is the same scheme logrotate uses.
+#
+#   Beside each sealed segment is a small summary (tempBT.txt.1.gz.summary)
+#   of its first and last record times and the locations in it. A query
+#   for a time range can then pass over segments outside the range
+#   without decompressing them.
+#
+#   parse_brifit reads any of these, given a directory of segments,
+#   a (quoted) glob such as "tempBT.txt*" or the files themselves.
+#
+#   logBT rotates before each run with
+#       python3 logsegments.py tempBT.txt
+#   (or python3 logsegments.py tempBT.txt xz to compress with xz)
+#
+
+"""
+
+import os
+import re
+import glob
+import sys
+import json
+import gzip
+import lzma
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+#   Rotate once the log is bigger than this
+
+rotateBytes = 8 * 1024 * 1024
+
+#   Keep this many sealed segments, 0 for all of them
+
+keepSegments = 0
+
+compression = ".gz"
+
+#   tempBT.txt.N with a compression suffix or not
+
+NUMBERED = re.compile(r"^(.*)\.(\d+)(\.gz|\.xz|\.zst)?$")
+
+SUFFIXES = (".gz", ".xz", ".zst")
+
+
+def summaryfile(filename):
+    return filename + ".summary"
+
+
+def compressed(filename):
+    return filename.endswith(SUFFIXES)
+
+
+#   Open a segment for reading (text) or writing (binary),
+#   decompressing or compressing as its name says
+
+
+def opensegment(filename, mode="rt"):
+    opener = open
+    if filename.endswith(".gz"):
+        opener = gzip.open
+    elif filename.endswith(".xz"):
+        opener = lzma.open
+    elif filename.endswith(".zst"):
+        if zstandard is None:
+            print(filename, "needs zstandard installed (pip install zstandard)")
+            exit()
+        opener = zstandard.open
+
+    if "t" in mode:
+        return opener(filename, mode, errors="replace")
+    return opener(filename, mode)
+
+
+#   Which segment a file is: its number, 0 for the live log
+#   (or anything else not numbered)
+
+
+def number(filename):
+    found = NUMBERED.match(filename)
+    return int(found.group(2)) if found else 0
+
+
+#   Segments oldest first: highest number down to the live log.
+#   Renumbering them in this order never overwrites one
+
+
+def chronological(filenames):
+    return sorted(filenames, key=lambda filename: (-number(filename), filename))
+
+
+#   Leave out the summaries, parse_brifit's and rollups' files kept
+#   beside the log and anything half written, e.g. when given tempBT.txt*
+
+
+def issegment(filename):
+    if os.path.isdir(filename):
+        return False
+    if filename.endswith((".summary", ".ckpt", ".idx", ".rollup")):
+        return False
+    return ".tmp" not in os.path.basename(filename)
+
+
+def segments(filenames):
+    return chronological([filename for filename in filenames if issegment(filename)])
+
+
+#   The segments in a directory or matching a glob, oldest first
+
+
+def directorysegments(directory):
+    return segments(os.path.join(directory, name) for name in os.listdir(directory))
+
+
+def globsegments(pattern):
+    return segments(glob.glob(pattern))
+
+
+#   The sealed segments of a log, oldest first
+
+
+def sealed(filename):
+    directory = os.path.dirname(filename)
+    base = os.path.basename(filename)
+    found = []
+    for name in os.listdir(directory or "."):
+        numbered = NUMBERED.match(name)
+        if numbered and numbered.group(1) == base:
+            found.append(os.path.join(directory, name))
+    return chronological(found)
+
+
+#   A log and its sealed segments, oldest first. Just the segments if
+#   nothing has been written to the log since it was rotated
+
+
+def withsealed(filename):
+    found = sealed(filename)
+    if os.path.exists(filename) or found == []:
+        found.append(filename)
+    return found
+
+
+#
+#   First and last record times and the locations in a segment.
+#   bytes is the segment's size, so a summary that no longer goes
+#   with its segment can be spotted
+#
+
+
+def summarise(filename):
+    first = None
+    last = None
+    locations = set()
+    records = 0
+
+    import parse_brifit
+
+    with opensegment(filename) as handle:
+        for point in parse_brifit.iterrecords(handle):
+            stamp = point[0].timestamp()
+            if first is None:
+                first = stamp
+            last = stamp
+            records += 1
+            for item in point[1:]:
+                locations.add(item.split(",")[0].strip().replace("'", ""))
+
+    return {
+        "first": first,
+        "last": last,
+        "locations": sorted(locations),
+        "records": records,
+        "bytes": os.path.getsize(filename),
+    }
+
+
+def loadsummary(filename):
+    try:
+        with open(summaryfile(filename), "r") as handle:
+            summary = json.load(handle)
+        if summary["bytes"] == os.path.getsize(filename):
+            return summary
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def savesummary(filename, summary):
+    temporary = summaryfile(filename) + ".tmp"
+    with open(temporary, "w") as handle:
+        json.dump(summary, handle)
+    os.replace(temporary, summaryfile(filename))
+
+
+#
+#   Could a segment have records with start <= date < end in it?
+#   (either None for no limit). Without a summary, e.g. the live log,
+#   it has to be read to find out
+#
+
+
+def overlaps(filename, start=None, end=None):
+    summary = loadsummary(filename)
+    if summary is None:
+        return True
+    if summary["first"] is None:
+        return False  # Nothing in it
+    if start is not None and summary["last"] < start.timestamp():
+        return False
+    if end is not None and end.timestamp() <= summary["first"]:
+        return False
+    return True
+
+
+def wanted(filenames, start=None, end=None):
+    if start is None and end is None:
+        return filenames
+    return [filename for filename in filenames if overlaps(filename, start, end)]
+
+
+#   Compress a file to filename + suffix and remove it
+
+
+def compress(filename, suffix):
+    temporary = filename + ".tmp" + suffix
+    with open(filename, "rb") as source:
+        with opensegment(temporary, "wb") as sealed:
+            while True:
+                block = source.read(1024 * 1024)
+                if block == b"":
+                    break
+                sealed.write(block)
+    os.replace(temporary, filename + suffix)
+    os.remove(filename)
+    return filename + suffix
+
+
+#   Files kept beside a sealed segment: its summary and rollups' cache
+#   of it. They go where it goes
+
+BESIDE = (".summary", ".rollup")
+
+
+def move(old, new):
+    os.replace(old, new)
+    for ending in BESIDE:
+        if os.path.exists(old + ending):
+            os.replace(old + ending, new + ending)
+
+
+def remove(filename):
+    os.remove(filename)
+    for ending in BESIDE:
+        if os.path.exists(filename + ending):
+            os.remove(filename + ending)
+
+
+#
+#   Seal the log off as segment 1 if its bigger than size, moving the
+#   older segments up one and dropping any past keepSegments.
+#   Returns the new segment or None if it wasn't rotated.
+#   Whatever writes the log must reopen it afterwards, logBT does
+#   each run anyway.
+#
+
+
+def rotate(filename, suffix=None, size=None):
+    if suffix is None:
+        suffix = compression
+    if size is None:
+        size = rotateBytes
+
+    if not os.path.exists(filename) or os.path.getsize(filename) <= size:
+        return None
+
+    for path in sealed(filename):
+        count = number(path)
+        if 0 < keepSegments <= count:
+            remove(path)
+            continue
+        ending = NUMBERED.match(path).group(3) or ""
+        move(path, filename + "." + str(count + 1) + ending)
+
+    segment = filename + ".1"
+    os.replace(filename, segment)
+    summary = summarise(segment)
+    segment = compress(segment, suffix)
+    summary["bytes"] = os.path.getsize(segment)
+    savesummary(segment, summary)
+
+    return segment
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if len(args) not in (1, 2) or (len(args) == 2 and "." + args[1] not in SUFFIXES):
+        print("Usage: logsegments.py LogFile [gz|xz|zst]")
+        exit()
+    rotate(args[0], "." + args[1] if len(args) == 2 else None)
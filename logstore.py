@@ -0,0 +1,205 @@
+"""
+
+#
+#   Columnar store for the sensor log
+#
+#   An alternative to the text log that needs no parsing to read back.
+#   A directory holds one file per column of fixed width little endian
+#   values, appended to a row per sensor per report, plus a list of
+#   location names (a location column value is a line number in it).
+#
+#       time        seconds since the epoch
+#       location    index into the locations file
+#       then temperature, humidity, vpd, dew point, heat index, battery
+#
+#   Columns are read by memory mapping so asking for one column over
+#   a time range only touches that column and just the part wanted.
+#   A row half written when something fell over is ignored.
+#
+#   Fill one from an existing text log with
+#       python3 logstore.py tempBT.txt storedirectory
+#
+
+"""
+
+import os
+import sys
+import datetime
+import numpy
+
+#   In the order thermoBeacon reports them
+
+VALUES = ["temperature", "humidity", "vpd", "dew_point", "heat_index", "battery"]
+
+COLUMNS = [("time", "<f8"), ("location", "<u2")] + [(name, "<f8") for name in VALUES]
+
+LOCATIONS = "locations"
+
+
+def column_file(directory, name):
+    return os.path.join(directory, name + ".col")
+
+
+#   Location names in the order they were first seen
+
+
+def locations(directory):
+    try:
+        with open(os.path.join(directory, LOCATIONS), "r") as handle:
+            return [line.rstrip("\n") for line in handle]
+    except FileNotFoundError:
+        return []
+
+
+#
+#   Add a report to the store. when is a datetime, results the
+#   (location, temperature, humidity, vpd, dew point, heat index, battery)
+#   tuples thermoBeacon prints after Data:
+#
+
+
+def append(directory, when, results):
+    append_rows(directory, [(when, results)])
+
+
+#   Many reports in one go, [(when, results), ...]
+
+
+def append_rows(directory, reports):
+    os.makedirs(directory, exist_ok=True)
+
+    known = locations(directory)
+    index = {name: number for number, name in enumerate(known)}
+    added = []
+
+    rows = []
+    for when, results in reports:
+        stamp = when.timestamp()
+        for result in results:
+            name = str(result[0])
+            if name not in index:
+                index[name] = len(known) + len(added)
+                added.append(name)
+            rows.append((stamp, index[name]) + tuple(result[1:7]))
+
+    if added:
+        with open(os.path.join(directory, LOCATIONS), "a") as handle:
+            for name in added:
+                handle.write(name + "\n")
+
+    if rows == []:
+        return
+
+    #   Lose any half written row from last time so the columns
+    #   stay in step
+
+    complete = length(directory)
+    table = numpy.array(rows, dtype=COLUMNS)
+    for name, kind in COLUMNS:
+        with open(column_file(directory, name), "ab") as handle:
+            handle.truncate(complete * numpy.dtype(kind).itemsize)
+            handle.write(table[name].tobytes())
+
+
+#   How many complete rows there are
+
+
+def length(directory):
+    sizes = []
+    for name, kind in COLUMNS:
+        try:
+            size = os.path.getsize(column_file(directory, name))
+        except FileNotFoundError:
+            return 0
+        sizes.append(size // numpy.dtype(kind).itemsize)
+    return min(sizes)
+
+
+#   Memory map a column, the first rows rows of it
+
+
+def column(directory, name, rows=None):
+    if rows is None:
+        rows = length(directory)
+    kind = dict(COLUMNS)[name]
+    if rows == 0:
+        return numpy.zeros(0, dtype=kind)
+    return numpy.memmap(
+        column_file(directory, name), dtype=kind, mode="r", shape=(rows,)
+    )
+
+
+#
+#   Columns asked for over a time range, start <= time < end, either
+#   given as datetimes or None for no limit. Rows are in the order they
+#   were written which is time order so the range is found by bisection.
+#   Returns {column name: array}
+#
+
+
+def query(directory, names=None, start=None, end=None):
+    if names is None:
+        names = [name for name, kind in COLUMNS]
+
+    rows = length(directory)
+    times = column(directory, "time", rows)
+
+    first = 0
+    last = rows
+    if start is not None:
+        first = numpy.searchsorted(times, start.timestamp(), side="left")
+    if end is not None:
+        last = numpy.searchsorted(times, end.timestamp(), side="left")
+
+    return {name: column(directory, name, rows)[first:last] for name in names}
+
+
+#
+#   One value as a table of time against location as parse_brifit shows it.
+#   Returns the times (as datetimes), location names sorted, and a
+#   2D array with a row per time and NaN where a location didn't report
+#
+
+
+def table(directory, name, start=None, end=None):
+    found = query(directory, ["time", "location", name], start, end)
+    names = locations(directory)
+
+    order = sorted(range(len(names)), key=lambda number: names[number])
+    position = numpy.zeros(max(len(names), 1), dtype=numpy.intp)
+    position[order] = numpy.arange(len(order))
+
+    stamps, row = numpy.unique(found["time"], return_inverse=True)
+    grid = numpy.full((len(stamps), len(names)), numpy.nan)
+    grid[row, position[found["location"]]] = found[name]
+
+    when = [datetime.datetime.fromtimestamp(stamp) for stamp in stamps]
+
+    return when, [names[number] for number in order], grid
+
+
+#   Fill a store from a text log
+
+
+def import_log(filename, directory):
+    import parse_brifit
+
+    reports = []
+    for point in parse_brifit.loadrecords(filename):
+        results = []
+        for item in point[1:]:
+            decomp = item.split(",")
+            results.append(
+                [decomp[0].strip().replace("'", "")]
+                + parse_brifit.readings(decomp[1:7])
+            )
+        reports.append((point[0], results))
+
+    append_rows(directory, reports)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: logstore.py InputFile StoreDirectory")
+        exit()
+    import_log(sys.argv[1], sys.argv[2])
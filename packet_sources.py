@@ -0,0 +1,366 @@
+"""
+
+#
+#   Where thermoBeacon gets its raw bluetoothctl lines from
+#
+#   A packet source produces lines of text as bluetoothctl would print
+#   them. collect() reads a source in one asyncio task and hands the
+#   lines to a consumer (e.g. ScanAggregator.feed) in another, so
+#   decoding goes on while we wait on the radio.
+#
+#   collect_all() does the same for several sources at once, e.g. one per
+#   bluetooth controller.
+#
+#   Three sources:
+#       BluetoothctlSource  the real thing, bluetoothctl as a subprocess
+#       ReplaySource        a saved scan, pickled list (rawBTdata.pk) or text
+#       SyntheticSource     made up sensors, as many and as fast as you like
+#
+#   The last two let the whole pipeline be run and load tested
+#   without a radio.
+
+"""
+
+import abc
+import asyncio
+import pickle
+import random
+import btcapture
+
+#   Bits of bluetoothctl's output, colour codes and all
+
+PROMPT = "\x1b[0;94m[bluetooth]\x1b[0m# \r\x1b[K"
+NEW = PROMPT + "[\x01\x1b[0;92m\x02NEW\x01\x1b[0m\x02] Device "
+CHANGE = PROMPT + "[\x01\x1b[0;93m\x02CHG\x01\x1b[0m\x02] Device "
+
+
+#   What every source looks like. lines() is an async iterator
+#   of raw lines, close() tidies up whatever was started.
+
+
+class PacketSource(abc.ABC):
+    @abc.abstractmethod
+    def lines(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+#
+#   bluetoothctl run as an asyncio subprocess
+#   Same conversation as thermoBeacon.start_scan() has via pexpect
+#
+
+
+class BluetoothctlSource(PacketSource):
+    def __init__(self, controllerMAC=""):
+        self.controllerMAC = controllerMAC
+        self.process = None
+
+    async def send(self, command):
+        self.process.stdin.write((command + "\n").encode("utf-8"))
+        await self.process.stdin.drain()
+
+    async def lines(self):
+        self.process = await asyncio.create_subprocess_exec(
+            "bluetoothctl",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+
+        # Wait till its ready to talk
+
+        while True:
+            raw = await self.process.stdout.readline()
+            if not raw:
+                return
+            if "Agent registered" in raw.decode("utf-8", "replace"):
+                break
+
+        if self.controllerMAC != "":
+            await self.send("select " + self.controllerMAC)
+
+        # 	select low power mode . we are looking for low power advertising packets
+
+        await self.send("menu scan")
+        await self.send("transport le")
+        await self.send("back")
+        await self.send("scan on")
+
+        while True:
+            raw = await self.process.stdout.readline()
+            if not raw:
+                return
+            yield raw.decode("utf-8", "replace")
+
+    async def close(self):
+        if self.process is None or self.process.returncode is not None:
+            return
+        try:
+            await self.send("scan off")
+            await self.send("exit")
+            await asyncio.wait_for(self.process.wait(), 5.0)
+        except (OSError, asyncio.TimeoutError):
+            self.process.kill()
+            await self.process.wait()
+
+
+#
+#   Replay a saved scan. Either a capture (see btcapture.py), a pickled
+#   list of lines as written by thermoBeacon (saveTestData / tempfail.pk)
+#   or a plain text file.
+#   rate limits the lines per second, None goes as fast as possible
+#
+
+
+class ReplaySource(PacketSource):
+    def __init__(self, filename, rate=None):
+        self.filename = filename
+        self.rate = rate
+
+    def load(self):
+        if btcapture.is_capture(self.filename):
+            return capture_lines(self.filename)
+        with open(self.filename, "rb") as handle:
+            try:
+                return pickle.load(handle)
+            except Exception:
+                pass  # not a pickle, try it as text
+        with open(self.filename, "r", encoding="utf-8", errors="replace") as handle:
+            return handle.readlines()
+
+    async def lines(self):
+        pace = Pacer(self.rate)
+        for count, line in enumerate(self.load()):
+            await pace.wait(count)
+            yield line
+
+
+#
+#   Encode a reading the way a thermoBeacon advertises it, as the hex
+#   dump bluetoothctl prints. Reversed MAC then little endian pairs of
+#   bytes for volts, temperature, humidity and counter.
+#   The inverse of thermoBeacon.interpret()
+#
+
+
+def manufacturer_lines(mac, volts, temp, humid, counter):
+    values = [
+        round(volts * 1000.0),
+        round(temp * 16),
+        round(humid * 16),
+        counter,
+    ]
+
+    payload = [0, 0] + [int(byte, 16) for byte in reversed(mac.split(":"))]
+    for value in values:
+        value &= 0xFFFF
+        payload += [value & 0xFF, value >> 8]
+    payload += [0, 0, 0, 0, 0, 0]
+
+    first = " ".join("%02x" % byte for byte in payload[:16])
+    second = " ".join("%02x" % byte for byte in payload[16:])
+
+    return [
+        CHANGE + mac + " ManufacturerData Key: 0x0010\r\n",
+        CHANGE + mac + " ManufacturerData Value:\r\n",
+        PROMPT + "  " + first + "  ................\r\n",
+        PROMPT + "  " + second.ljust(47) + "  ....            \r\n",
+    ]
+
+
+#
+#   A capture file (btcapture.py) as the lines bluetoothctl would have
+#   printed: each thermometer announces itself when first seen and each
+#   event is its signal strength, if known, then the hex dump
+#
+
+
+def capture_lines(filename):
+    seen = set()
+    for when, mac, rssi, data in btcapture.events(filename):
+        if mac not in seen:
+            seen.add(mac)
+            yield NEW + mac + " ThermoBeacon\r\n"
+        if rssi is not None:
+            yield CHANGE + mac + " RSSI: %d\r\n" % rssi
+        yield PROMPT + "  " + data.hex(" ") + "  ................\r\n"
+
+
+#
+#   Keep to rate items a second, against a running deadline so the time
+#   taken between sleeps doesn't slow things down. None goes flat out,
+#   just letting other tasks in every so often
+#
+
+
+class Pacer:
+    def __init__(self, rate):
+        self.rate = rate
+        self.started = None
+
+    async def wait(self, count):
+        if self.rate is None:
+            if count % 100 == 0:
+                await asyncio.sleep(0)
+            return
+
+        loop = asyncio.get_running_loop()
+        if self.started is None:
+            self.started = loop.time()
+        await asyncio.sleep(max(0.0, self.started + count / self.rate - loop.time()))
+
+
+#
+#   Made up sensors. Each announces itself then advertises readings that
+#   drift about, repeating each one a few times a second before its
+#   counter ticks over like the real ones do. rate is packets per second
+#   (None flat out) and packets how many before stopping (None for ever).
+#   The counters follow the time the packets are due, or flat out, each
+#   sensor's repeats packets count as a second.
+#
+
+
+class SyntheticSource(PacketSource):
+    def __init__(self, sensors=4, rate=None, packets=None, repeats=5, seed=0):
+        self.sensors = sensors
+        self.rate = rate
+        self.packets = packets
+        self.repeats = repeats
+        self.random = random.Random(seed)
+        self.macs = [
+            "5B:%02X:00:00:%02X:%02X" % (n >> 16, (n >> 8) & 0xFF, n & 0xFF)
+            for n in range(sensors)
+        ]
+
+    def announcements(self):
+        return [NEW + mac + " ThermoBeacon\r\n" for mac in self.macs]
+
+    async def lines(self):
+        for line in self.announcements():
+            yield line
+
+        #   volts, temperature, humidity, counter, counter at the start
+
+        state = {}
+        for mac in self.macs:
+            counter = self.random.randint(100, 1500)
+            state[mac] = [
+                2.9 + self.random.random() * 0.1,
+                self.random.uniform(0.0, 25.0),
+                self.random.uniform(30.0, 90.0),
+                counter,
+                counter,
+            ]
+
+        pace = Pacer(self.rate)
+        sent = 0
+        while self.packets is None or sent < self.packets:
+            mac = self.macs[sent % self.sensors]
+            reading = state[mac]
+
+            if self.rate is None:
+                seconds = (sent // self.sensors) // self.repeats
+            else:
+                seconds = int(sent / self.rate)
+
+            if reading[3] != reading[4] + seconds:
+                reading[3] = reading[4] + seconds
+                reading[1] += self.random.uniform(-0.1, 0.1)
+                reading[2] = min(
+                    99.0, max(1.0, reading[2] + self.random.uniform(-0.5, 0.5))
+                )
+
+            yield CHANGE + mac + " RSSI: %d\r\n" % self.random.randint(-95, -60)
+            for line in manufacturer_lines(mac, *reading[:4]):
+                yield line
+
+            await pace.wait(sent)
+            sent += 1
+
+
+#
+#   Read a source for up to duration seconds handing each line to consume.
+#   The source is read in its own task into a bounded queue so a slow
+#   consumer holds up the source rather than memory growing.
+#   Stops early if consume returns True or the source runs out.
+#   Returns the number of lines consumed.
+#
+
+
+async def collect(source, consume, duration, queuesize=1000):
+    queue = asyncio.Queue(maxsize=queuesize)
+    finished = object()
+
+    #   Any failure of the source (no bluetoothctl, missing file...)
+    #   just ends the collection, the caller sees how many lines it got
+
+    async def reader():
+        try:
+            async for line in source.lines():
+                await queue.put(line)
+        except Exception:
+            pass
+        await queue.put(finished)
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + duration
+    task = asyncio.create_task(reader())
+    count = 0
+
+    try:
+        while True:
+            try:
+                line = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    line = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            if line is finished:
+                break
+            count += 1
+            if consume(line):
+                break
+            if deadline <= loop.time():
+                break
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await source.close()
+
+    return count
+
+
+#
+#   Several sources at once, e.g. one bluetoothctl per controller, each
+#   read in its own task and handing its lines to its own consumer.
+#   They all stop once any consumer says it has enough.
+#   Returns the number of lines consumed from each.
+#
+
+
+async def collect_all(sources, consumers, duration, queuesize=1000):
+    done = False
+
+    def until_done(consume):
+        def wrapper(line):
+            nonlocal done
+            if not done:
+                done = bool(consume(line))
+            return done
+
+        return wrapper
+
+    return await asyncio.gather(
+        *[
+            collect(source, until_done(consume), duration, queuesize)
+            for source, consume in zip(sources, consumers)
+        ]
+    )
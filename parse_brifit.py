@@ -5,7 +5,14 @@
 
 from datetime import datetime
 from dateutil import parser, tz
+import os
 import sys
+import pickle
+import bisect
+import concurrent.futures
+import numpy
+import logstore
+import logsegments
 
 
 # Get rid of stuff after the specified string if its in there
@@ -17,6 +24,59 @@ def cutstring(delimiter, record):
     return record
 
 
+#
+#   The log only has dates in two forms, what python prints for
+#   datetime.now() e.g. 2023-01-26 17:05:03.123456 and what the date
+#   command gives e.g. Thu 26 Jan 17:05:03 GMT 2023. Deal with those
+#   directly and only hand anything else to the much slower dateutil.
+#   Returns None if it isn't a date
+#
+
+months = {
+    name: number + 1
+    for number, name in enumerate(
+        ["Jan", "Feb", "Mar", "Apr", "May", "Jun",
+         "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+    )
+}
+
+utczones = {"GMT": tz.tzutc(), "UTC": tz.tzutc()}
+
+
+def parsedate(record):
+    record = record.strip()
+    if record == "":
+        return None
+
+    try:
+        return datetime.fromisoformat(record)
+    except ValueError:
+        pass
+
+    # date command style, in a zone we can be sure of
+
+    parts = record.split()
+    if len(parts) == 6 and parts[2] in months and parts[4] in utczones:
+        clock = parts[3].split(":")
+        try:
+            return datetime(
+                int(parts[5]),
+                months[parts[2]],
+                int(parts[1]),
+                int(clock[0]),
+                int(clock[1]),
+                int(clock[2]),
+                tzinfo=utczones[parts[4]],
+            )
+        except (ValueError, IndexError):
+            pass
+
+    try:
+        return parser.parse(record)
+    except Exception as err:
+        return None
+
+
 def parse_measurement(DATE, record):
     datums = [DATE]
 
@@ -38,29 +98,6 @@ def parse_measurement(DATE, record):
     return datums
 
 
-def findlocs(locdata):
-    locations = set()
-    for point in locdata:
-        DAT = point.pop(0)
-        meas = point
-        for item in meas:
-            decomp = item.split(",")
-            locations.add(decomp[0])
-        # Reverse the effect of the pop
-        point.insert(0, DAT)  # I should be working on a copy of the data but
-    # not leaving it alone screws up. I lose the date info.
-    # I don't understand that.
-
-    #   NOTE: 'I should be working on a copy of the data' isn't how it works.
-    #   Read https://nedbatchelder.com/text/names.html
-
-    loc = list(locations)
-    for index, bori in enumerate(loc):
-        loc[index] = loc[index].replace("'", "")
-
-    return sorted(loc)
-
-
 def flttofixed(value):
     # Need numeric values in fixed width
 
@@ -96,11 +133,21 @@ def output(graph):
 
 
 def usage():
-    print("Usage: InputFile Parameter samples(last N)")
+    print("Usage: InputFile... Parameter samples(last N)")
+    print("InputFile can be a text log or a store directory (see logstore.py)")
+    print("Several logs (e.g. rotated or from other hosts) are merged in time order")
+    print("as are a directory or (quoted) glob of segments, see logsegments.py")
+    print("Options before InputFile:")
+    print("  --tail         only read as much of the end of the log as needed")
+    print("  --incremental  only parse what has been added since last time")
+    print("  --from DATE    only records at or after DATE")
+    print("  --to DATE      only records before DATE")
+    print("  --jobs N       parse in N processes (0 for one per cpu)")
     print("Where Parameter codes are:\n")
     print(
         "temperature 1  humidity 2 vpd_point  3 dew_point  4 heat_index 5 Battery Voltage    6\n"
     )
+    print("or 0 for all of them\n")
 
 
 parametermeanings = [
@@ -122,13 +169,37 @@ def validateargs(headerOnly):
     caller = sys.argv.pop(0)
     inputargs = sys.argv
 
-    if len(inputargs) != 3:
+    #   How to read a text log
+
+    mode = "all"
+    jobs = None
+    limits = {"--from": None, "--to": None}
+    while inputargs != [] and inputargs[0].startswith("--"):
+        option = inputargs.pop(0)
+        if option == "--tail":
+            mode = "tail"
+        elif option == "--incremental":
+            mode = "incremental"
+        elif option == "--jobs" and inputargs != [] and inputargs[0].isdigit():
+            jobs = int(inputargs.pop(0))
+        elif option in limits and inputargs != []:
+            limits[option] = parsedate(inputargs.pop(0))
+            if limits[option] is None:
+                usage()
+                exit()
+        else:
+            usage()
+            exit()
+
+    if len(inputargs) < 3:
         usage()
         exit()
 
     filename = inputargs[0]
-    parameterSTR = inputargs[1]
-    items = inputargs[2]
+    if len(inputargs) > 3:
+        filename = inputargs[:-2]
+    parameterSTR = inputargs[-2]
+    items = inputargs[-1]
 
     if not parameterSTR.isdigit():
         usage()
@@ -140,13 +211,22 @@ def validateargs(headerOnly):
         exit()
     itemsRequired = int(items)
 
-    if parameter < 1 or 6 < parameter:
+    if parameter < 0 or 6 < parameter:
         usage()
         exit()
 
     #   Survived running the gauntlet
 
-    massagerawdata(filename, parameter, headerOnly, itemsRequired)
+    massagerawdata(
+        filename,
+        parameter,
+        headerOnly,
+        itemsRequired,
+        mode,
+        limits["--from"],
+        limits["--to"],
+        jobs,
+    )
 
 
 #
@@ -156,66 +236,605 @@ def validateargs(headerOnly):
 outputData = True
 
 
-def massagerawdata(filename, dataItem, headerOnly, itemsRequired):
+#
+#   Read the log into a list of [date, "location, values..." ...]
+#   one per Data: record
+#
+
+
+def loadrecords(filename):
     resurrect = open(filename, "r")
     restored = resurrect.readlines()
     resurrect.close()
 
-    dataset = []
+    return parselines(restored)
+
+
+#   The Data: records in a list of lines from the log
+
+
+def parselines(restored):
+    return list(iterrecords(restored))
+
+
+#   One at a time as [date, "location, values..." ...]
+
+
+def iterrecords(restored):
+    delimiter = "Data:"
 
     for measurement in restored:
+
+        # Only Data: records are of interest so don't bother
+        # working out the date of anything else
+
+        if delimiter not in measurement:
+            continue
+
+        if "No temperature data in scan" in measurement:
+            continue
+
         # Isolate the datestring by getting rid of everything that follows
         # a few choice phrases
 
+        record = measurement[: measurement.index(delimiter)]
+        record = cutstring("Signal", record)
+        record = cutstring("No thermometers found", record)
+
+        # All that should be left is the date
+
+        DATE = parsedate(record)
+        if DATE is None:
+            continue
+
         record = measurement
+        record = record[record.index(delimiter) + len(delimiter) :]
+        yield parse_measurement(DATE, record)
+
+
+#
+#   Just the last few records. Read backwards from the end of the log a
+#   block at a time till we have enough, so it takes the same time
+#   however big the log is
+#
+
+
+def tailrecords(filename, wanted, blocksize=65536):
+    dataset = []
+
+    with open(filename, "rb") as handle:
+        position = handle.seek(0, os.SEEK_END)
+        remainder = b""
+
+        while 0 < position and len(dataset) < wanted:
+            step = min(blocksize, position)
+            position -= step
+            handle.seek(position)
+            lines = (handle.read(step) + remainder).split(b"\n")
+
+            # The first line is likely only part of one unless
+            # we've got back to the start
+
+            if 0 < position:
+                remainder = lines.pop(0)
+
+            lines = [line.decode("utf-8", "replace") for line in lines]
+            dataset = parselines(lines) + dataset
+
+    return dataset[-wanted:] if 0 < wanted else []
+
+
+#
+#   Parse only what's been added since last time. What we had is kept
+#   with how far through the log we got in a checkpoint next to it.
+#   If the log looks to have been replaced or cut short start again.
+#
+
+
+def checkpointfile(filename):
+    return filename + ".ckpt"
+
+
+def logidentity(filename):
+    with open(filename, "rb") as handle:
+        return (os.fstat(handle.fileno()).st_ino, handle.read(256))
+
+
+#   What a checkpoint saved, if it still applies to the log.
+#   Returns the offset reached and whatever was saved with it,
+#   or 0 and None to start from the beginning
+
+
+def loadcheckpoint(filename, checkpoint):
+    identity = logidentity(filename)
+
+    try:
+        with open(checkpoint, "rb") as handle:
+            saved = pickle.load(handle)
+        inode, head = saved["identity"]
+        if inode == identity[0] and identity[1].startswith(head):
+            if saved["offset"] <= os.path.getsize(filename):
+                return saved["offset"], saved["state"]
+    except Exception:
+        pass  # No checkpoint or one we can't use, read the lot
+
+    return 0, None
+
+
+def savecheckpoint(filename, checkpoint, offset, state):
+    try:
+        with open(checkpoint, "wb") as handle:
+            pickle.dump(
+                {"identity": logidentity(filename), "offset": offset, "state": state},
+                handle,
+            )
+    except OSError:
+        pass  # Can't save it, next time will just take longer
+
+
+#   What's been added to the log since offset. Returns the complete lines,
+#   what there is of a last line that may still be being written, and
+#   the offset just after the last complete line
+
+
+def readfrom(filename, offset):
+    with open(filename, "rb") as handle:
+        handle.seek(offset)
+        added = handle.read()
+
+    complete = added.rfind(b"\n") + 1
+    lines = added[:complete].decode("utf-8", "replace").split("\n")
+    partial = added[complete:].decode("utf-8", "replace")
+
+    return lines, partial, offset + complete
+
+
+def incrementaltable(filename):
+    offset, table = loadcheckpoint(filename, checkpointfile(filename))
+    if table is None:
+        table = LogTable()
+
+    # Only checkpoint complete lines, the last may still be being written
+
+    lines, partial, offset = readfrom(filename, offset)
+    table.addlines(lines)
+    table.trim()
+    savecheckpoint(filename, checkpointfile(filename), offset, table)
+
+    table.addlines([partial])
+
+    return table
+
+
+#
+#   A sparse index of the log kept beside it (tempBT.txt.idx). Every
+#   indexEvery'th Data: record's time and where it starts in the file.
+#   Extended with whatever has been added each time its used, and
+#   rebuilt if the log has been replaced or cut short.
+#   Returns {"times": [...], "offsets": [...], "seen": records so far}
+#
+
+indexEvery = 64
+
+
+def indexfile(filename):
+    return filename + ".idx"
+
+
+def updateindex(filename):
+    offset, index = loadcheckpoint(filename, indexfile(filename))
+    if index is None:
+        index = {"times": [], "offsets": [], "seen": 0}
+
+    position = offset
+    with open(filename, "rb") as handle:
+        handle.seek(offset)
+        for line in handle:
+            if not line.endswith(b"\n"):
+                break  # Still being written, leave it till next time
+
+            if b"Data:" in line:
+                if index["seen"] % indexEvery == 0:
+                    found = parselines([line.decode("utf-8", "replace")])
+                    if found != []:
+                        index["times"].append(found[0][0].timestamp())
+                        index["offsets"].append(position)
+                index["seen"] += 1
+
+            position += len(line)
+
+    savecheckpoint(filename, indexfile(filename), position, index)
+
+    return index
+
+
+#
+#   Records with start <= date < end (either None for no limit).
+#   The log is in time order so the index tells us roughly where
+#   these are. Read and parse just that part of the file.
+#
+
 
-        if "No temperature data in scan" in record:
+def rangerecords(filename, start=None, end=None):
+    index = updateindex(filename)
+    times = index["times"]
+    offsets = index["offsets"]
+
+    first = 0
+    if start is not None:
+        sample = bisect.bisect_left(times, start.timestamp()) - 1
+        if 0 <= sample:
+            first = offsets[sample]
+
+    last = None
+    if end is not None:
+        sample = bisect.bisect_left(times, end.timestamp())
+        if sample < len(offsets):
+            last = offsets[sample]
+
+    with open(filename, "rb") as handle:
+        handle.seek(first)
+        if last is None:
+            chunk = handle.read()
+        else:
+            chunk = handle.read(last - first)
+
+    dataset = []
+    for point in iterrecords(chunk.decode("utf-8", "replace").split("\n")):
+        stamp = point[0].timestamp()
+        if start is not None and stamp < start.timestamp():
+            continue
+        if end is not None and end.timestamp() <= stamp:
             continue
+        dataset.append(point)
 
-        record = cutstring("Signal", record)
-        record = cutstring("Data:", record)
-        record = cutstring("No thermometers found", record)
-        
-        #record = record.replace(" ","")
+    return dataset
+
+
+#
+#   Parsing in parallel. Each log is cut into pieces at line boundaries,
+#   the pieces parsed in a pool of processes and the results put back
+#   together in time order. Worth it for years of log or many logs.
+#
+
+chunkBytes = 4 * 1024 * 1024
 
-    # All that should be left is the date
 
+#   Where to cut a file into pieces of about chunkBytes, each ending
+#   at the end of a line. Returns [(first, last), ...] byte offsets
+
+
+def chunkbounds(filename, size=None):
+    if size is None:
+        size = chunkBytes
+
+    #   Can't seek in a compressed segment, it's one piece
+
+    if logsegments.compressed(filename):
+        return [(0, None)]
+
+    length = os.path.getsize(filename)
+
+    bounds = []
+    with open(filename, "rb") as handle:
+        first = 0
+        while first < length:
+            handle.seek(first + size)
+            handle.readline()
+            last = min(handle.tell(), length)
+            bounds.append((first, last))
+            first = last
+
+    return bounds
+
+
+#   Parse one piece. Runs in a worker process so returns plain data:
+#   the dates, location names by column and the values array
+
+
+def parsechunk(filename, first, last, start=None, end=None):
+    if last is None:
+        with logsegments.opensegment(filename) as handle:
+            table = rangetable(handle, start, end)
+    else:
+        with open(filename, "rb") as handle:
+            handle.seek(first)
+            chunk = handle.read(last - first)
+        table = rangetable(chunk.decode("utf-8", "replace").split("\n"), start, end)
+    table.trim()
+
+    names = sorted(table.columns, key=table.columns.get)
+    return table.dates, names, table.values
+
+
+#   A LogTable of the records in lines (any iterable, e.g. an open
+#   file) with start <= timestamp < end, either None for no limit
+
+
+def rangetable(lines, start=None, end=None):
+    table = LogTable()
+    for point in iterrecords(lines):
+        stamp = point[0].timestamp()
+        if start is not None and stamp < start:
+            continue
+        if end is not None and end <= stamp:
+            continue
+        table.add(point[0], point[1:])
+    return table
+
+
+#
+#   Every value from any number of logs, parsed by jobs processes
+#   (None or 0 for one per cpu) and merged in time order.
+#   As extractall()
+#
+
+
+def parallelload(filenames, jobs=None, start=None, end=None):
+    if start is not None:
+        start = start.timestamp()
+    if end is not None:
+        end = end.timestamp()
+
+    pieces = []
+    for filename in filenames:
+        for first, last in chunkbounds(filename):
+            pieces.append((filename, first, last, start, end))
+
+    with concurrent.futures.ProcessPoolExecutor(jobs or None) as pool:
+        parsed = list(pool.map(parsechunk, *zip(*pieces))) if pieces else []
+
+    loc = sorted(set(name for dates, names, values in parsed for name in names))
+    column = {name: number for number, name in enumerate(loc)}
+
+    rows = sum(len(dates) for dates, names, values in parsed)
+    merged = numpy.full((rows, len(loc), len(parametermeanings)), numpy.nan)
+    alldates = []
+    for dates, names, values in parsed:
+        row = len(alldates)
+        merged[row : row + len(dates), [column[name] for name in names]] = values
+        alldates += dates
+
+    #   Pieces of one log are already in order but logs from different
+    #   hosts interleave
+
+    order = numpy.argsort([DATE.timestamp() for DATE in alldates], kind="stable")
+    merged = merged[order]
+
+    series = {}
+    for item, meaning in enumerate(parametermeanings):
+        series[meaning] = merged[:, :, item]
+
+    return [alldates[row] for row in order], loc, series
+
+
+#   Values of a record as numbers, NaN for any missing off the end or
+#   that aren't numbers, e.g. in a line cut short and run into the next.
+#   Anything after one that isn't can't be trusted to be in its place
+#   so is NaN too
+
+
+def readings(values):
+    numbers = [numpy.nan] * len(parametermeanings)
+    for index, value in enumerate(values[: len(numbers)]):
         try:
-            DATE = parser.parse(record)
-        except Exception as err:
-             continue
-
-        delimiter = "Data:"
-        if delimiter in measurement:
-            record = measurement
-            record = record[record.index(delimiter) + len(delimiter) :]
-            meas = parse_measurement(DATE, record)
-            dataset.append(meas)
-
-    locdata = dataset.copy()
-    rawdata = list(dataset)
-
-    loc = findlocs(locdata)  # Make output human friendly if possible
-
-    datalist = []
-    for point in rawdata:
-        datapoint = [None] * (len(loc) + 1)
-        datapoint[0] = point.pop(0)
-        meas = point
-        for oom in meas:
-            decomp = oom.split(",")
+            numbers[index] = float(value)
+        except ValueError:
+            break
+    return numbers
+
+
+#
+#   Every value for every location built up a record at a time.
+#   Locations get a column each as they turn up, and values go
+#   straight into a numpy array (row per record, column per location,
+#   a slot per parameter) with NaN where a location didn't report.
+#   The array is made bigger as needed, doubling each time.
+#
+
+
+class LogTable:
+    def __init__(self, capacity=1024):
+        self.dates = []
+        self.columns = {}  # location name -> column
+        self.values = numpy.full((capacity, 4, len(parametermeanings)), numpy.nan)
+
+    def grow(self, rows, columns):
+        bigger = numpy.full((rows, columns, len(parametermeanings)), numpy.nan)
+        used = self.values[: len(self.dates), : len(self.columns)]
+        bigger[: used.shape[0], : used.shape[1]] = used
+        self.values = bigger
+
+    #   Column for a location, giving it one if its new
+
+    def intern(self, name):
+        column = self.columns.get(name)
+        if column is None:
+            column = len(self.columns)
+            if column == self.values.shape[1]:
+                self.grow(self.values.shape[0], max(2 * column, 1))
+            self.columns[name] = column
+        return column
+
+    def add(self, DATE, items):
+        row = len(self.dates)
+        if row == self.values.shape[0]:
+            self.grow(max(2 * row, 1), self.values.shape[1])
+        self.dates.append(DATE)
+
+        for item in items:
+            decomp = item.split(",")
             dblquot = decomp[0]
             dblquot = dblquot.replace("'", "")  # simplify double quote to single
-            pos = loc.index(dblquot)
-            datapoint[pos + 1] = decomp[dataItem]
-        datalist.append(datapoint)
+            column = self.intern(dblquot)
+            self.values[row, column] = readings(decomp[1:7])
+
+    def addrecords(self, dataset):
+        for point in dataset:
+            self.add(point[0], point[1:])
+
+    def addlines(self, lines):
+        for point in iterrecords(lines):
+            self.add(point[0], point[1:])
+
+    #   Drop the unused space, e.g. before saving
+
+    def trim(self):
+        self.grow(len(self.dates), len(self.columns))
+
+    #   As extractall()
+
+    def result(self):
+        loc = sorted(self.columns)  # Make output human friendly if possible
+        order = [self.columns[name] for name in loc]
+        values = self.values[: len(self.dates), order]
+
+        series = {}
+        for item, meaning in enumerate(parametermeanings):
+            series[meaning] = values[:, :, item]
+
+        return list(self.dates), loc, series
+
+
+#
+#   Every value for every location from a list of records.
+#   Returns the dates, location names sorted, and a dict of
+#   parameter meaning -> 2D array, a row per record and a column per
+#   location with NaN where a location didn't report
+#
+
+
+def extractall(dataset):
+    table = LogTable(len(dataset))
+    table.addrecords(dataset)
+    return table.result()
+
+
+#
+#   Segments of a rotated log (see logsegments.py) given as a directory
+#   or a glob, as a list oldest first. Anything else as it is
+#
+
+
+def findsegments(filename):
+    if isinstance(filename, list):
+        return logsegments.segments(filename)
+
+    if os.path.isdir(filename):
+        if os.path.exists(logstore.column_file(filename, "time")):
+            return filename
+        return logsegments.directorysegments(filename)
 
+    if not os.path.exists(filename) and any(magic in filename for magic in "*?["):
+        return logsegments.globsegments(filename)
+
+    return filename
+
+
+#
+#   Read a text log (all of it, just the tail or what's new) or a
+#   columnar store and get everything out of it in one go.
+#   filename can be a list of logs, or jobs given, to parse in parallel.
+#   Sealed segments are passed over if outside start to end.
+#   As extractall()
+#
+
+
+def loadall(filename, mode="all", itemsRequired=0, start=None, end=None, jobs=None):
+    filename = findsegments(filename)
+    if not isinstance(filename, list) and logsegments.compressed(filename):
+        filename = [filename]
+
+    #   A log that's been rotated goes on in its sealed segments. Those
+    #   wanted are read with it, else the log is read as it always was.
+    #   --tail and --incremental only look at the log itself
+
+    if not isinstance(filename, list) and not os.path.isdir(filename):
+        if mode == "all":
+            sealed = logsegments.sealed(filename)
+            if logsegments.wanted(sealed, start, end) != []:
+                filename = logsegments.withsealed(filename)
+
+    #   Only a single plain log can be read from the end or
+    #   from a checkpoint
+
+    if mode != "all" and (isinstance(filename, list) or jobs is not None):
+        print("--tail and --incremental need a single uncompressed log")
+        exit()
+
+    if isinstance(filename, list):
+        filenames = logsegments.wanted(filename, start, end)
+        return parallelload(filenames, jobs, start, end)
+
+    if jobs is not None and not os.path.isdir(filename):
+        return parallelload([filename], jobs, start, end)
+
+    if os.path.isdir(filename):
+        series = {}
+        for item, meaning in enumerate(parametermeanings):
+            dates, loc, series[meaning] = logstore.table(
+                filename, logstore.VALUES[item], start, end
+            )
+        return dates, loc, series
+
+    if start is not None or end is not None:
+        return extractall(rangerecords(filename, start, end))
+
+    if mode == "tail":
+        return extractall(tailrecords(filename, itemsRequired))
+
+    if mode == "incremental":
+        return incrementaltable(filename).result()
+
+    # Straight from the file, a line at a time
+
+    table = LogTable()
+    with open(filename, "r") as resurrect:
+        table.addlines(resurrect)
+    return table.result()
+
+
+#   Print the last few rows of one parameter
+
+
+def showtable(dataItem, dates, loc, grid, headerOnly, itemsRequired):
     print(parametermeanings[dataItem - 1], "at locations")
     print("\t\t", loc)
 
     if not headerOnly:
-        itemsRequired = min(itemsRequired, len(datalist))
-        output(datalist[-itemsRequired:])
+        itemsRequired = min(itemsRequired, len(dates))
+        datalist = []
+        for index in range(len(dates))[-itemsRequired:]:
+            datapoint = [dates[index]]
+            for value in grid[index]:
+                datapoint.append(None if value != value else str(value))  # NaN
+            datalist.append(datapoint)
+        output(datalist)
+
+
+#   Parameter 0 shows all of them, still from just the one parse
+
+
+def massagerawdata(
+    filename,
+    dataItem,
+    headerOnly,
+    itemsRequired,
+    mode="all",
+    start=None,
+    end=None,
+    jobs=None,
+):
+    dates, loc, series = loadall(filename, mode, itemsRequired, start, end, jobs)
+
+    if dataItem == 0:
+        wanted = range(1, len(parametermeanings) + 1)
+    else:
+        wanted = [dataItem]
+
+    for item in wanted:
+        grid = series[parametermeanings[item - 1]]
+        showtable(item, dates, loc, grid, headerOnly, itemsRequired)
 
     exit()
 
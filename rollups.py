@@ -0,0 +1,247 @@
+#
+# 	Hourly, daily and monthly summaries of the log
+#
+#   For each location and each bucket of time the min, mean and max
+#   of each parameter and how many samples went into it.
+#
+#   Working these out over years of log takes a while so the totals
+#   are kept in a cache beside the log (tempBT.txt.rollup) along with
+#   how far through the log they go. Later runs only add in what has
+#   been appended since. If the log is replaced or cut short the cache
+#   is thrown away and it starts again.
+#
+#   Sealed segments of the log (see logsegments.py) each have their
+#   own cache beside them, which moves with them as they're renumbered,
+#   so rotating the log only means summarising the newly sealed one.
+#   Given tempBT.txt its sealed segments are included, as they are
+#   given a directory or glob of segments.
+#
+#   A columnar store (see logstore.py) can be given instead of the
+#   log. That's quick enough to summarise every time so isn't cached.
+#
+
+import os
+import sys
+import numpy
+import parse_brifit
+import logsegments
+
+#   How a date is turned into its bucket for each period
+
+periods = {
+    "hourly": "%Y-%m-%d %H:00",
+    "daily": "%Y-%m-%d",
+    "monthly": "%Y-%m",
+}
+
+# 	Totals for a location in a bucket are an array with a row per
+#   parameter of min, max, sum, count
+
+MIN, MAX, SUM, COUNT = range(4)
+
+
+def cachefile(filename):
+    return filename + ".rollup"
+
+
+#   The cache is thrown away if it was made by a version that summarised
+#   differently. 2: failed sensors' placeholder readings left out
+
+CACHEVERSION = 2
+
+
+def loadcache(filename):
+    offset, cached = parse_brifit.loadcheckpoint(filename, cachefile(filename))
+    if not isinstance(cached, dict) or cached.get("version") != CACHEVERSION:
+        return 0, None
+    return offset, cached["rollup"]
+
+
+def savecache(filename, offset, rollup):
+    parse_brifit.savecheckpoint(
+        filename,
+        cachefile(filename),
+        offset,
+        {"version": CACHEVERSION, "rollup": rollup},
+    )
+
+
+#
+#   Summarise a table of values, as parse_brifit.LogTable.result() gives,
+#   into {period: {bucket: {location: totals}}}
+#   The log is in time order so each bucket is a run of rows and can be
+#   reduced in one go
+#
+
+
+def summarise(dates, loc, series):
+    rollup = {period: {} for period in periods}
+    if dates == []:
+        return rollup
+
+    values = numpy.stack([series[name] for name in parse_brifit.parametermeanings], 2)
+
+    #   A sensor with no good samples in a scan is logged as
+    #   (location, 0.0, -273.15, 100.0, -1, -1, -1), that's no reading at all
+
+    failed = values[:, :, 1] == -273.15
+    values = numpy.where(failed[:, :, numpy.newaxis], numpy.nan, values)
+
+    present = values == values  # not NaN
+    zeroed = numpy.where(present, values, 0.0)
+
+    for period, form in periods.items():
+        keys = [when.strftime(form) for when in dates]
+        starts = [0] + [
+            row for row in range(1, len(keys)) if keys[row] != keys[row - 1]
+        ]
+
+        with numpy.errstate(invalid="ignore"):
+            mins = numpy.fmin.reduceat(values, starts, axis=0)
+            maxs = numpy.fmax.reduceat(values, starts, axis=0)
+        sums = numpy.add.reduceat(zeroed, starts, axis=0)
+        counts = numpy.add.reduceat(present, starts, axis=0)
+
+        for run, start in enumerate(starts):
+            for column, location in enumerate(loc):
+                if not counts[run, column].any():
+                    continue
+                totals = numpy.stack(
+                    [
+                        mins[run, column],
+                        maxs[run, column],
+                        sums[run, column],
+                        counts[run, column],
+                    ],
+                    1,
+                )
+                merge(rollup[period], keys[start], location, totals)
+
+    return rollup
+
+
+#   Add totals in to what we have for a location in a bucket
+
+
+def merge(buckets, bucket, location, totals):
+    locations = buckets.setdefault(bucket, {})
+    have = locations.get(location)
+    if have is None:
+        locations[location] = totals
+        return
+
+    have[:, MIN] = numpy.fmin(have[:, MIN], totals[:, MIN])
+    have[:, MAX] = numpy.fmax(have[:, MAX], totals[:, MAX])
+    have[:, SUM] += totals[:, SUM]
+    have[:, COUNT] += totals[:, COUNT]
+
+
+def mergeall(rollup, more):
+    for period, buckets in more.items():
+        for bucket, locations in buckets.items():
+            for location, totals in locations.items():
+                merge(rollup[period], bucket, location, totals)
+
+
+#
+#   The summaries for a log, bringing the cache up to date
+#
+
+
+def rollups(filename):
+    found = parse_brifit.findsegments(filename)
+    if not isinstance(found, list):
+        if os.path.isdir(found):
+            return summarise(*parse_brifit.loadall(found))
+        found = logsegments.withsealed(found)
+
+    rollup = {period: {} for period in periods}
+    for segment in found:
+        mergeall(rollup, segmentrollups(segment))
+
+    return rollup
+
+
+#   The summaries for one segment (or log), from or into its cache.
+#   A compressed segment won't change so it's summarised just the once
+
+
+def segmentrollups(filename):
+    if logsegments.compressed(filename):
+        offset, rollup = loadcache(filename)
+        if rollup is None:
+            with logsegments.opensegment(filename) as handle:
+                rollup = summarise(*parse_brifit.rangetable(handle).result())
+            savecache(filename, os.path.getsize(filename), rollup)
+        return rollup
+
+    offset, rollup = loadcache(filename)
+    if rollup is None:
+        rollup = {period: {} for period in periods}
+
+    # Only complete lines, a part written one will be there next time
+
+    lines, partial, offset = parse_brifit.readfrom(filename, offset)
+    table = parse_brifit.LogTable()
+    table.addlines(lines)
+    mergeall(rollup, summarise(*table.result()))
+
+    savecache(filename, offset, rollup)
+
+    return rollup
+
+
+def usage():
+    print("Usage: InputFile Period Parameter buckets(last N)")
+    print("Where Period is one of", ", ".join(periods))
+    print("and Parameter codes are as parse_brifit.py:\n")
+    print(
+        "temperature 1  humidity 2 vpd_point  3 dew_point  4 heat_index 5 Battery Voltage    6\n"
+    )
+
+
+#   A line per location per bucket: min mean max and how many samples
+
+
+def output(buckets, item, itemsRequired):
+    wanted = sorted(buckets)[-itemsRequired:] if 0 < itemsRequired else []
+
+    for bucket in wanted:
+        for location, totals in sorted(buckets[bucket].items()):
+            low, high, total, count = totals[item]
+            if count == 0:
+                continue
+            print(
+                bucket.ljust(16),
+                location.ljust(12),
+                parse_brifit.flttofixed(str(low)),
+                parse_brifit.flttofixed(str(total / count)),
+                parse_brifit.flttofixed(str(high)),
+                int(count),
+            )
+
+
+def main():
+    args = sys.argv[1:]
+    if len(args) != 4 or args[1] not in periods:
+        usage()
+        exit()
+    if not args[2].isdigit() or not args[3].isdigit():
+        usage()
+        exit()
+
+    item = int(args[2])
+    if item < 1 or 6 < item:
+        usage()
+        exit()
+
+    rollup = rollups(args[0])
+
+    print(parse_brifit.parametermeanings[item - 1], args[1], "min mean max count")
+    output(rollup[args[1]], item - 1, int(args[3]))
+
+
+# 	The usual entry point stuff...
+
+if __name__ == "__main__":
+    main()
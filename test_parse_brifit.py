@@ -0,0 +1,74 @@
+#
+#   Tests for parse_brifit.py, run with python3 -m pytest
+#
+
+import datetime
+import math
+
+import logsegments
+import parse_brifit
+
+#   The second report was cut short (a power cut say) and the next
+#   append ran on after it. The third is missing its last values
+
+LOG = """\
+2023-01-03 05:00:00.000000  Data: [('Kitchen', 12.5, 60.0, 0.58, 4.85, 11.7, 2.9)]
+2023-01-03 05:30:00.000000  Data: [('Kitchen', 13.0, 61.0, 0.5, 19.82023-01-03 06:00:00.000000  Data: [('Kitchen', 13.5, 62.0, 0.58, 6.2, 12.7, 2.8)]
+2023-01-03 06:30:00.000000  Data: [('Kitchen', 14.0, 63.0)]
+2023-01-03 07:00:00.000000  Data: [('Kitchen', 14.5, 64.0, 0.6, 7.5, 13.7, 2.7)]
+"""
+
+
+def test_bad_records_dont_spoil_the_rest(tmp_path):
+    filename = str(tmp_path / "tempBT.txt")
+    with open(filename, "w") as handle:
+        handle.write(LOG)
+
+    for dates, loc, series in (
+        parse_brifit.loadall(filename),
+        parse_brifit.loadall(filename, "incremental"),
+        parse_brifit.loadall(filename, jobs=1),
+        parse_brifit.loadall(
+            filename,
+            start=datetime.datetime(2023, 1, 3),
+            end=datetime.datetime(2023, 1, 4),
+        ),
+    ):
+        assert loc == ["Kitchen"]
+        temperature = series["Temperature"][:, 0]
+        battery = series["Battery Voltage"][:, 0]
+        dew = series["Dew_point"][:, 0]
+
+        assert list(temperature) == [12.5, 13.0, 14.0, 14.5]
+        assert battery[0] == 2.9 and battery[3] == 2.7
+
+        #   What's left of the cut short record and the short one
+
+        assert math.isnan(dew[1]) and math.isnan(battery[1])
+        assert math.isnan(series["Vapour Pressure Deficit"][2, 0])
+        assert math.isnan(battery[2])
+
+
+#   Given the log's own name once it has been rotated, its sealed
+#   segments are read too, as when given them all
+
+
+def test_rotated_log_read_with_its_segments(tmp_path):
+    filename = str(tmp_path / "tempBT.txt")
+    lines = LOG.splitlines(True)
+    with open(filename, "w") as handle:
+        handle.writelines(lines[:3])
+    logsegments.rotate(filename, size=0)
+    with open(filename, "w") as handle:
+        handle.writelines(lines[3:])
+
+    dates, loc, series = parse_brifit.loadall(filename)
+    assert list(series["Temperature"][:, 0]) == [12.5, 13.0, 14.0, 14.5]
+
+    dates, loc, series = parse_brifit.loadall(
+        filename, start=datetime.datetime(2023, 1, 3, 5, 15)
+    )
+    assert list(series["Temperature"][:, 0]) == [13.0, 14.0, 14.5]
+
+    dates, loc, series = parse_brifit.loadall(filename, "tail", 5)
+    assert list(series["Temperature"][:, 0]) == [14.5]
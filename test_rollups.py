@@ -0,0 +1,29 @@
+#
+#   Tests for rollups.py, run with python3 -m pytest
+#
+
+import rollups
+
+#   The middle report is thermoBeacon's placeholder for a sensor
+#   that got no good samples
+
+LOG = """\
+2023-01-03 05:00:00.000000  Data: [('Kitchen', 12.5, 60.0, 0.58, 4.85, 11.7, 2.9)]
+2023-01-03 05:30:00.000000  Data: [('Kitchen', 0.0, -273.15, 100.0, -1, -1, -1)]
+2023-01-03 06:00:00.000000  Data: [('Kitchen', 13.5, 62.0, 0.58, 6.2, 12.7, 2.8)]
+"""
+
+
+def test_placeholder_readings_left_out(tmp_path):
+    filename = str(tmp_path / "tempBT.txt")
+    with open(filename, "w") as handle:
+        handle.write(LOG)
+
+    for attempt in range(2):  # worked out, then from the cache
+        totals = rollups.rollups(filename)["daily"]["2023-01-03"]["Kitchen"]
+
+        temperature, humidity = totals[0], totals[1]
+        assert list(temperature) == [12.5, 13.5, 26.0, 2]
+        assert list(humidity) == [60.0, 62.0, 122.0, 2]
+        assert totals[5][rollups.MIN] == 2.8
+        assert (totals[:, rollups.COUNT] == 2).all()
@@ -0,0 +1,117 @@
+#
+#   Tests for thermoBeacon's decoding, run with python3 -m pytest
+#
+#   They use the scan saved in rawBTdata.pk (four thermometers) so no
+#   radio is needed.
+#
+
+import os
+import pickle
+import random
+import statistics
+
+import btcapture
+import packet_sources
+import thermoBeacon
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+#   A thermometer that announces itself but never sends any data
+
+SILENT = "[NEW] Device 11:22:33:44:55:66 ThermoBeacon"
+
+
+def saved_scan():
+    with open(os.path.join(HERE, "rawBTdata.pk"), "rb") as handle:
+        return pickle.load(handle)
+
+
+#   Each daemon window with a failed sensor replaces the failure
+#   capture rather than adding the same events to it again
+
+
+def test_failure_capture_replaced_each_window(tmp_path, monkeypatch, capsys):
+    failCapture = str(tmp_path / "tempfail.btc")
+    monkeypatch.setattr(thermoBeacon, "captureBinary", True)
+    monkeypatch.setattr(thermoBeacon, "failCapture", failCapture)
+    monkeypatch.setattr(thermoBeacon, "failLines", 100)
+
+    scan = thermoBeacon.ScanAggregator()
+    counts = []
+    for window in range(2):
+        for line in [SILENT] + saved_scan():
+            scan.feed(line)
+        scan.summary()
+        counts.append(len(btcapture.read(failCapture)))
+        scan.next_window()
+
+    assert counts == [100, 100]
+
+
+#   A thermometer with nothing that passes the checks gets the scan
+#   dumped, whichever thermometer it is, in batch as when streaming
+
+
+def test_failure_dumped_when_any_thermometer_fails(monkeypatch):
+    dumped = []
+    monkeypatch.setattr(thermoBeacon, "dump_failure", dumped.append)
+    monkeypatch.setattr(thermoBeacon, "captureBinary", False)
+
+    scan = [SILENT] + saved_scan()
+    results, rssi_stats = thermoBeacon.decode_scan(list(scan))
+    assert results[0][2] == -273.15  # the silent one, first of five
+    assert len(dumped) == 1
+
+    aggregator = thermoBeacon.ScanAggregator()
+    for line in scan:
+        aggregator.feed(line)
+    assert aggregator.summary() == (results, rssi_stats)
+    assert len(dumped) == 2
+
+
+#   A capture decoded straight from its records comes to the same as
+#   replaying the lines it stands for one at a time
+
+
+def test_capture_fed_whole_same_as_lines(tmp_path, monkeypatch):
+    capture = str(tmp_path / "rawBTdata.btc")
+    btcapture.convert(os.path.join(HERE, "rawBTdata.pk"), capture)
+    monkeypatch.setattr(thermoBeacon, "captureBinary", True)
+    monkeypatch.setattr(thermoBeacon, "findRssi", True)
+
+    lines = thermoBeacon.ScanAggregator()
+    for line in packet_sources.capture_lines(capture):
+        lines.feed(line)
+    records = thermoBeacon.ScanAggregator()
+    assert records.feed_capture(capture) == 128
+
+    assert list(records.thermometers) == list(lines.thermometers)
+    assert records.readings == lines.readings
+    assert records.summary() == lines.summary()
+    assert [event[1:] for event in records.recent] == [
+        event[1:] for event in lines.recent
+    ]
+
+
+#   The running median of counters agrees with statistics.median of
+#   every value added, counters repeated and weighted as they come
+
+
+def test_running_median_matches_statistics():
+    generator = random.Random(1)
+    for trial in range(20):
+        running = thermoBeacon.RunningMedian()
+        assert running.median() is None
+        everything = []
+        start = generator.uniform(0.0, 5000.0)
+        for step in range(200):
+            if generator.random() < 0.3 and everything != []:
+                value = generator.choice(everything)  # heard again
+            else:
+                value = start + generator.randrange(100) / 4.0
+            times = generator.choice([1, 1, 1, 2, 3, 7])
+            running.add(value, times)
+            everything += [value] * times
+
+            assert running.total == len(everything)
+            assert running.median() == statistics.median(everything)
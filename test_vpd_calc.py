@@ -0,0 +1,50 @@
+#
+#   Tests for vpd_calc's lookup table, run with python3 -m pytest
+#
+
+import math
+
+import numpy
+
+import vpd_calc
+
+
+#   Off the table (too hot, or no temperature at all) single values
+#   are worked out with derived() rather than looked up
+
+
+def test_lookup_scalar_outside_table():
+    for t, rh in ((70.0, 50.0), (-25.0, 40.0), (20.0, 150.0)):
+        found = vpd_calc.lookup(t, rh)
+        expected = vpd_calc.derived(t, rh)
+        for value, wanted in zip(found, expected):
+            assert numpy.shape(value) == ()
+            assert math.isclose(float(value), float(wanted), rel_tol=1e-12)
+
+    for value in vpd_calc.lookup(float("nan"), 50.0):
+        assert numpy.shape(value) == ()
+        assert math.isnan(value)
+
+
+#   On the table, single values and arrays agree with the scalar sums
+
+
+def test_lookup_matches_scalar_functions():
+    t = numpy.array([[16.625, 4.4375], [-20.0, 65.0]])
+    rh = numpy.array([[62.5, 81.0], [0.0625, 100.0]])
+
+    found = vpd_calc.lookup(t, rh)
+    for values in found:
+        assert values.shape == t.shape
+
+    for index in numpy.ndindex(t.shape):
+        expected = (
+            vpd_calc.vpd(t[index], rh[index]),
+            vpd_calc.dew(t[index], rh[index]),
+            vpd_calc.heat_index(t[index], rh[index]),
+        )
+        for values, wanted in zip(found, expected):
+            assert abs(values[index] - wanted) < 1e-4
+
+    single = vpd_calc.lookup(16.625, 62.5)
+    assert abs(float(single[0]) - vpd_calc.vpd(16.625, 62.5)) < 1e-4
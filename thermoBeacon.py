@@ -19,21 +19,33 @@
 #  and checks on timestamps. The odd packet is arriving
 #  with radically incorrect values.
 #
+#  By default this is done as each line arrives (streamDecode)
+#  so nothing much is held in memory however long the scan.
+#
 #  bluetoothctl needs to be run with appropriate privs
 #  running as root or preferably being in group lp works
 #  You may well think alternatives are more to your liking
 
 """
 
+import asyncio
+import contextlib
+import json
 import pexpect
 import numpy
 from numpy import mean
 import time
-import statistics
+import heapq
 import pickle
 import sys
 import vpd_calc
 import datetime
+from collections import deque
+import packet_sources
+import btcapture
+import logstore
+import exporter
+import btlexer
 
 #   Debugging facility: save and restore sensor data
 #   replay and debug by loading it by changing flags
@@ -52,6 +64,31 @@ dataDumpFile = home_directory + "/rawBTdata.pk"
 
 faildata = home_directory + "/tempfail.pk"
 
+#   When streaming, saved scans and failures are written in the compact
+#   binary format of btcapture.py: just the advertising events rather
+#   than every line bluetoothctl printed. False pickles lines as above.
+#   dataLoadFile can be either sort.
+
+captureBinary = True
+captureFile = home_directory + "/rawBTdata.btc"
+failCapture = home_directory + "/tempfail.btc"
+
+#   As well as printing the Data: record, append the results to this
+#   columnar store (see logstore.py) which parse_brifit can read
+#   without parsing text. "" for just the printed record.
+
+storeDirectory = ""
+
+#   Export the latest readings in Prometheus text format (see exporter.py)
+#   so dashboards needn't parse the log. metricsPort serves them over
+#   HTTP on metricsAddress while running as a daemon, 0 for not.
+#   metricsFile is rewritten each report for node_exporter's textfile
+#   collector, for runs from cron. "" for not.
+
+metricsPort = 0
+metricsAddress = "127.0.0.1"
+metricsFile = ""
+
 
 #   Define which controller to use.
 #   Had to include a better v5 bluetooth dongle to read low power
@@ -65,11 +102,47 @@ controllerMAC = "0E:12:34:4E:AB:20"
 # controllerMAC = "8C:88:2B:67:23:CE"
 # controllerMAC = "0E:12:34:4E:A6:C7"
 
+#   Or scan with several controllers at once, e.g. dongles in different
+#   buildings, and combine what they all hear. Each gets its own
+#   bluetoothctl (or packetSource, for testing) running concurrently.
+#   The same packet heard by more than one within duplicateWindow
+#   seconds is only counted once. Signal strengths are reported for
+#   each controller. Fewer than two uses controllerMAC as above.
+#
+# controllerMACs = ["0E:12:34:4E:AB:20", "8C:88:2B:67:23:CE", "0E:12:34:4E:A6:C7"]
+controllerMACs = []
+duplicateWindow = 1.0
+
 #   The time needed on a scan to collect enough advertising packets
 #   I've worked out experimentally.  Might be overkill
 #
 scantime = 300.0
 
+#   Adaptive scan: stop as soon as every sensor we know about (those in
+#   MACLocations and any other thermoBeacon that turns up) has this many
+#   samples passing the temperature and counter checks. scantime is
+#   still the upper limit. 0 always scans for the full scantime.
+#   Only applies when streaming (streamDecode)
+
+samplesWanted = 0
+
+#   Daemon mode (thermoBeacon.py --daemon) keeps one bluetoothctl
+#   session scanning for ever and writes a Data: record each
+#   emitInterval seconds (or as given after --daemon).
+#   If bluetoothctl falls over it is restarted after restartDelay.
+
+emitInterval = 60.0
+restartDelay = 30.0
+
+#   Collect using asyncio and one of the sources in packet_sources.py
+#   rather than pexpect. "" keeps pexpect, otherwise one of
+#   "bluetoothctl", "replay" (of dataLoadFile) or "synthetic"
+#   (syntheticSensors made up sensors at syntheticRate packets/second)
+
+packetSource = ""
+syntheticSensors = 4
+syntheticRate = 1000.0
+
 #   I work out the thermoBeacon MAC's from the scan but one thing
 #   I can't work out is where they are. This dictionary relates
 #   MACs to location.  This degrades gracefully if an unknown MAC appears.
@@ -89,6 +162,36 @@ MACLocations = {
 
 findRssi = False
 
+#   Streaming mode: rather than buffer the whole scan and trawl through
+#   it afterwards, each line is tidied, classified and decoded as it
+#   arrives and folded into running totals for each MAC.
+#   Memory then depends on the number of distinct readings rather than
+#   on how long the scan runs. Set False for the original batch decode.
+
+streamDecode = True
+
+#   When streaming we don't hold the whole scan, so on failure
+#   only the last few lines are available to dump for inspection
+
+failLines = 2000
+
+#   Instrumentation: how long each stage took and where the packets
+#   went (lines read, ManufacturerData records per sensor, how many the
+#   temperature range and counter window checks threw out, how many
+#   samples were left). Written for every run, good or bad.
+#   "" for none, "-" prints a Stats: record of JSON after the Data: line,
+#   anything else is a file to append a line of JSON to each run.
+
+statsFile = ""
+
+#   A thermometer repeats the same packet many times before its counter
+#   moves on. Count each (MAC, counter) reading once so the averages
+#   aren't weighted by how often a packet happened to be heard. The
+#   repeats, and an estimate of packets missed from the gaps in the
+#   counters, go in the stats. False averages every packet heard.
+
+dedupPackets = True
+
 # Data types in order they appear in the records, and the
 # scaling factors to get to the stated units
 
@@ -103,44 +206,76 @@ mintemp = -20.0
 maxtemp = 65.0
 
 
-#   Tidy up all sort of junk from the records
+#   Lines are sorted out by btlexer.lex(). Is this event a
+#   thermometer announcing itself
 
 
-def tidy(record):
+def is_thermometer(event):
+    return event.kind == btlexer.ANNOUNCE and "THERMOBEACON" in event.value.upper()
 
-    nocrud = record.replace("\n", "")
-    nocrud = nocrud.replace("\r", "")
-    nocrud = nocrud.replace("\x1b", "")
-    nocrud = nocrud.upper()
 
-    # 	The most robust method appears to be to delete
-    # 	whatever appears prior to the Device string
-    # 	which seems to vary
+#   Spawn bluetoothctl and talk using utf-8
+#   Tried a number of alternatives ; expect from bash, coproc etc.
+#   python pexpect seems by far the most robust and understandable (by me at least).
+#   Select controller , then start scan
 
-    if "DEVICE" in nocrud:
-        cutdown = nocrud[nocrud.index("DEVICE") :]
-        return cutdown.upper()
 
-    return nocrud
+def start_scan(controllerMAC):
+    child = pexpect.spawn("bluetoothctl", encoding="utf-8", timeout=scantime)
 
+    # 	uncommenting this line gives useful debug output for
+    # 	monitoring progress of bluetoothctl
 
-# Old fashioned way to map a function over a list...
+    # child.logfile = sys.stdout
+    child.expect("Agent registered")
+    result = child.readline()
+    child.expect("#")
+    if controllerMAC != "":
+        child.send("select " + controllerMAC + "\n")
+        result = child.readline()
 
+    # 	select low power mode . we are looking for low power advertising packets
 
-def tidyList(records):
-    for index, elem in enumerate(records):
-        records[index] = tidy(records[index])
+    child.send("menu scan\n")
+    child.send("transport le\n")
+    child.send("back\n")
+    child.expect("#")
 
+    child.send("scan on\n")
 
-#   Spawn bluetoothctl and talk using utf-8
-#   Tried a number of alternatives ; expect from bash, coproc etc.
-#   python pexpect seems by far the most robust and understandable (by me at least).
-#   Select controller , then start scan
+    return child
+
+
+#   Close down the child.
+
+
+def stop_scan(child):
+    child.send("scan off\n")
+    child.send("exit\n")
+    child.expect("#")
+    child.close()
 
 
-def collect_data(controllerMAC):
+def collect_data(controllerMAC, consume=None):
 
     DeviceScan = []
+    lines = 0
+
+    #   If given somewhere to send the lines hand them straight on
+    #   rather than buffering them all. Still buffer if we've been
+    #   asked to pickle the scan. If consume returns True its got
+    #   all it needs and the scan can stop.
+
+    pickling = saveTestData and (consume is None or not captureBinary)
+
+    def keep(result):
+        nonlocal lines
+        lines += 1
+        if consume is None or pickling:
+            DeviceScan.append(result)
+        if consume is not None:
+            return consume(result)
+        return False
 
     # 	Alternativly, if requested
     #   Load test data and return if required.
@@ -148,14 +283,22 @@ def collect_data(controllerMAC):
     # for debugging
 
     if loadTestData:
-        with open(dataLoadFile, "rb") as handle:
-            DeviceScan = pickle.load(handle)
-        handle.close()
+        if btcapture.is_capture(dataLoadFile):
+            DeviceScan = list(packet_sources.capture_lines(dataLoadFile))
+        else:
+            with open(dataLoadFile, "rb") as handle:
+                DeviceScan = pickle.load(handle)
+            handle.close()
 
         if [] == DeviceScan:
             print("Data collection failed\n")
             exit()
 
+        if consume is not None:
+            for result in DeviceScan:
+                if consume(result):
+                    break
+
         return DeviceScan
 
     #
@@ -166,45 +309,19 @@ def collect_data(controllerMAC):
     #   you just get a null results list
 
     try:
-        child = pexpect.spawn("bluetoothctl", encoding="utf-8", timeout=scantime)
-
-        # 	uncommenting this line gives useful debug output for
-        # 	monitoring progress of bluetoothctl
-
-        # child.logfile = sys.stdout
-        child.expect("Agent registered")
-        result = child.readline()
-        child.expect("#")
-        if controllerMAC != "":
-            child.send("select " + controllerMAC + "\n")
-            result = child.readline()
+        child = start_scan(controllerMAC)
 
-        # 	select low power mode . we are looking for low power advertising packets
-
-        child.send("menu scan\n")
-        child.send("transport le\n")
-        child.send("back\n")
-        child.expect("#")
-
-        #   Collect raw records making everything upper case to
-        #   simplify searchs.
+        #   Collect raw records
 
         timeout = scantime  # [seconds]
         timeout_start = time.time()
 
-        child.send("scan on\n")
-
         while time.time() < timeout_start + timeout:
             result = child.readline()
-            DeviceScan.append(result)
-
-        #   Close down the child.
-        #
+            if keep(result):
+                break
 
-        child.send("scan off\n")
-        child.send("exit\n")
-        child.expect("#")
-        child.close()
+        stop_scan(child)
 
     #   Catch all sorts of nonsense... wrong controller
     #   can't get hold of the dongle etc
@@ -212,13 +329,13 @@ def collect_data(controllerMAC):
     except:
         pass
 
-    if [] == DeviceScan:
+    if 0 == lines:
         print("Data collection failed\n")
         exit()
 
     # Store data (serialize) for later reload/run/debug
 
-    if saveTestData:
+    if pickling:
         handle = open(dataLoadFile, "wb")
         pickle.dump(DeviceScan, handle)
         handle.close()
@@ -226,6 +343,20 @@ def collect_data(controllerMAC):
     return DeviceScan
 
 
+#
+#   The packet source asked for, see packet_sources.py
+
+
+def make_source(controller=None):
+    if controller is None:
+        controller = controllerMAC
+    if packetSource == "replay":
+        return packet_sources.ReplaySource(dataLoadFile)
+    if packetSource == "synthetic":
+        return packet_sources.SyntheticSource(syntheticSensors, syntheticRate)
+    return packet_sources.BluetoothctlSource(controller)
+
+
 #
 #   Extract data from manufacturerData record
 #   Note that when presented to this function
@@ -279,198 +410,884 @@ def interpret(elem, inspect):
 
 
 #
-#   main thread...
+#   The same decode as interpret() but for a whole list of records at
+#   once using numpy. One row per record in a structured array with the
+#   MAC as a 48 bit number (see btcapture.mac_name) followed by the scaled values.
+#   Records only need to be tidied and start with the reversed MAC.
+
+DECODED = numpy.dtype(
+    [
+        ("mac", numpy.uint64),
+        ("volts", numpy.float64),
+        ("temp", numpy.float64),
+        ("humidity", numpy.float64),
+        ("counter", numpy.float64),
+    ]
+)
+
+
+def decode_batch(records):
+    if len(records) == 0:
+        return numpy.zeros(0, dtype=DECODED)
+
+    #   Reversed MAC and four pairs of data bytes, 14 bytes a record
+
+    hexstr = " ".join(" ".join(record.split()[:14]) for record in records)
+    raw = numpy.frombuffer(bytes.fromhex(hexstr), dtype=numpy.uint8)
+    return decode_bytes(raw.reshape(len(records), 14))
+
+
+#   The decode itself, given the 14 bytes of each record as a row
+
+
+def decode_bytes(raw):
+    decoded = numpy.zeros(len(raw), dtype=DECODED)
+
+    #   The MAC is reversed so the first byte is the least significant
+
+    for index in range(6):
+        decoded["mac"] |= raw[:, index].astype(numpy.uint64) << numpy.uint64(8 * index)
+
+    #   Data bytes are backwards in pairs i.e. little endian 16 bit
+
+    values = raw[:, 6:14].copy().view("<u2").astype(numpy.float64)
+    values /= numpy.array(scaling)
+
+    #   The same twos complement correction as interpret()
+
+    values[2048 <= values] -= 4096
+
+    for index, name in enumerate(["volts", "temp", "humidity", "counter"]):
+        decoded[name] = values[:, index]
+
+    return decoded
+
+
+#
+#   The same again straight from the records of a capture (btcapture.read)
+#   with no hex in between. A record's reversed MAC is somewhere in its
+#   data bytes: the first place it is with the rest of the record after it,
+#   as find_reversed_mac() looks. Records it isn't in are left out.
+
+
+def decode_capture(records):
+    data = records["data"]
+    shifts = numpy.arange(6, dtype=numpy.uint64) * numpy.uint64(8)
+    reversedmac = (records["mac"][:, numpy.newaxis] >> shifts) & numpy.uint64(0xFF)
+    reversedmac = reversedmac.astype(numpy.uint8)
+
+    #   Latest first so the first place found overwrites the rest
+
+    where = numpy.full(len(records), -1)
+    for index in range(btcapture.MAXBYTES - 14, -1, -1):
+        found = (data[:, index : index + 6] == reversedmac).all(axis=1)
+        where[found & (index + 14 <= records["length"])] = index
+
+    rows = numpy.flatnonzero(0 <= where)
+    columns = where[rows][:, numpy.newaxis] + numpy.arange(14)
+    return decode_bytes(data[rows[:, numpy.newaxis], columns])
+
+
+#   Rows of a decoded array as the [MAC, volts, temp, humidity, counter]
+#   lists interpret() gives
+
+
+def decoded_lists(decoded):
+    names = {value: btcapture.mac_name(value) for value in numpy.unique(decoded["mac"])}
+    return [[names[row[0]]] + list(row[1:]) for row in decoded.tolist()]
+
+
 #
+#   Averages for one sensor and the values derived from them
+#   data order is MAC,battery Voltage,Temperature,humidity and time
+
+
+def sensor_result(location, items, pwr, temp, humid):
+
+    #   if no data provide obviously incorrect data
+    #   want to have same output format as usual
+
+    if items == 0.0:
+        return (location, 0.0, -273.15, 100.0, -1, -1, -1)
+
+    # Form averages
+    pwr = pwr / items
+    temp = temp / items
+    humid = humid / items
+    # from which we determine these
+    vpd_point = vpd_calc.vpd(temp, humid)
+    dew_point = vpd_calc.dew(temp, humid)
+    heat_index = vpd_calc.heat_index(temp, humid)
+
+    # 	save results to two dp
+
+    return (
+        location,
+        round(temp, 2),
+        round(humid, 2),
+        round(vpd_point, 2),
+        round(dew_point, 2),
+        round(heat_index, 2),
+        round(pwr, 2),
+    )
+
+
+#   Keep what we've got so the failure can be looked at later
+
+
+def dump_failure(DeviceScan):
+    handle = open(faildata, "wb")
+    pickle.dump(DeviceScan, handle)
+    handle.close()
+
+
+#   The manufacturer data record has in it the MAC
+#   reversed, space separated
+
+
+def reverse_mac(mac):
+    decomp = mac.split(":")
+    if len(decomp) != 6:
+        return None
+    return " ".join(reversed(decomp))
+
+
+#   Look up each six byte stretch of a hex dump in the table of
+#   reversed MACs {reversed MAC: MAC}. Return the record from the
+#   MAC onwards ready for interpret() or None if no thermometer is in it.
+#   Costs the same however many thermometers there are.
+
+
+def find_reversed_mac(hexes, reversedMACs):
+    for index in range(len(hexes) - 13):
+        if " ".join(hexes[index : index + 6]) in reversedMACs:
+            return " ".join(hexes[index:])
+    return None
+
+
+#
+#   Running median of a MAC's counter values, updated a packet at a time
+#   so the counter window can be checked as packets arrive.
+#   Two heaps of the distinct values seen: those up to the median (negated,
+#   heapq only does min heaps) and those above, each value weighted by how
+#   often its been seen. Sensors repeat a packet many times before the
+#   counter ticks so there are few distinct values; memory doesn't grow
+#   with the number of packets and adding one is O(log distinct values).
+#   Same answer as statistics.median of every value added.
 #
 
 
-def main():
+class RunningMedian:
+    def __init__(self):
+        self.counts = {}  # value -> times seen
+        self.low = []  # negated values up to the median
+        self.high = []  # values above it
+        self.lowcount = 0  # times values in low have been seen
+        self.total = 0
+
+    def add(self, value, times=1):
+        if value in self.counts:
+            self.counts[value] += times
+            if value <= -self.low[0]:
+                self.lowcount += times
+        else:
+            self.counts[value] = times
+            if self.low == [] or value <= -self.low[0]:
+                heapq.heappush(self.low, -value)
+                self.lowcount += times
+            else:
+                heapq.heappush(self.high, value)
+        self.total += times
+
+        #   The largest value in low must be the one at the lower
+        #   middle position of everything seen, sorted
+
+        lower = (self.total - 1) // 2
+        while self.lowcount <= lower:
+            value = heapq.heappop(self.high)
+            heapq.heappush(self.low, -value)
+            self.lowcount += self.counts[value]
+        while lower < self.lowcount - self.counts[-self.low[0]]:
+            value = -heapq.heappop(self.low)
+            heapq.heappush(self.high, value)
+            self.lowcount -= self.counts[value]
+
+    def median(self):
+        if self.total == 0:
+            return None
+        low = -self.low[0]
+        if self.total % 2 == 1 or self.total // 2 < self.lowcount:
+            return low
+        return (low + self.high[0]) / 2
+
+
+#
+#   Streaming decode. Fed one raw line at a time as bluetoothctl
+#   produces it, each line is tidied, classified and decoded on the spot.
+#
+#   Rather than keep every packet, readings are kept per MAC as running
+#   totals per counter value {counter: [count, volts, temp, humidity]}.
+#   Sensors repeat the same packet many times between counter ticks
+#   so this is small, and it is all the counter window check needs.
+#   The answers are the same as decode_scan() gives on the whole scan.
+
+
+class ScanAggregator:
+    def __init__(self):
+        self.thermometers = {}  # MAC -> reversed MAC, in order found
+        self.reversedMACs = {}  # reversed MAC -> MAC
+        self.rssi = {}  # MAC -> [min, total, count, max]
+        self.readings = {}  # MAC -> {counter: [count, volts, temp, humidity, heard]}
+        self.medians = {}  # MAC -> RunningMedian of its counters
+        self.matched = 0  # ManufacturerData records decoded
+        self.inrange = 0  # of which passed the temperature check
+        self.satisfied = set()  # MACs with samplesWanted validated samples
+        self.lastrssi = {}  # MAC -> latest signal strength
+
+        #   With several controllers: signal strength as heard by each
+        #   and when each packet was last heard, to spot duplicates
+
+        self.controllers = {}  # controller -> {MAC: [min, total, count, max]}
+        self.lastheard = {}  # (MAC, data) -> (controller, time)
+        self.duplicates = 0
+
+        #   For the failure dump, the last few lines or capture events.
+        #   Every event also goes to capture if its been given a writer
+
+        self.recent = deque(maxlen=failLines)
+        self.capture = None
+
+    #   controller says which one heard it, when there are several
+
+    def feed(self, line, controller=None):
+        if not captureBinary:
+            self.recent.append(line)
+        event = btlexer.lex(line)
+        runStats.count("lines_read")
+
+        if event.kind == btlexer.NOISE:
+            runStats.count("noise_lines")
+            return
+
+        #   A thermometer announcing itself
+
+        if is_thermometer(event):
+            runStats.count("announcements")
+            mac = event.mac
+            if mac not in self.thermometers:
+                ribit = reverse_mac(mac)
+                self.thermometers[mac] = ribit
+                if ribit is not None:
+                    self.reversedMACs[ribit] = mac
+            return
+
+        #   Signal strength. Keep it for any device since the
+        #   thermometer may not have announced itself yet
+
+        if event.kind == btlexer.RSSI:
+            runStats.count("rssi_lines")
+            self.add_rssi(event.mac, event.value, controller)
+            return
+
+        if event.kind != btlexer.DATA:
+            return
+
+        #   Records with reversed MAC's in them are manufacturer data
+
+        hexes = event.value
+        if len(hexes) >= 14:
+            runStats.count("hex_lines")
+        cutdown = find_reversed_mac(hexes, self.reversedMACs)
+        if cutdown is not None:
+            if controller is not None and self.duplicate(controller, cutdown):
+                return self.complete()
+            datapoint = interpret(cutdown, False)
+            if captureBinary:
+                self.record_event(datapoint[0], hexes)
+            self.add(datapoint)
+
+        return self.complete()
 
     #
-    #   Get raw data
+    #   A whole capture (btcapture.py) at once, decoded with
+    #   decode_capture() rather than turned back into lines and fed
+    #   one at a time. Each thermometer counts as announced from the
+    #   first record of it. Returns the number of records
     #
 
-    DeviceScan = collect_data(controllerMAC)
+    def feed_capture(self, filename):
+        records = btcapture.read(filename)
+        runStats.count("capture_records", len(records))
+
+        macs = records["mac"]
+        values, first = numpy.unique(macs, return_index=True)
+        names = {}
+        for value in values[numpy.argsort(first)].tolist():
+            mac = names[value] = btcapture.mac_name(value)
+            if mac not in self.thermometers:
+                ribit = reverse_mac(mac)
+                self.thermometers[mac] = ribit
+                self.reversedMACs[ribit] = mac
+
+        heard = records["rssi"] != btcapture.NORSSI
+        for value, pwr in zip(macs[heard].tolist(), records["rssi"][heard].tolist()):
+            self.add_rssi(names[value], pwr)
+
+        for datapoint in decoded_lists(decode_capture(records)):
+            self.add(datapoint)
+
+        #   What feed() would have kept for the failure dump
 
-    #   Tidy up all sort of junk from the records
+        if captureBinary:
+            tail = records[max(0, len(records) - failLines) :]
+            self.recent.extend(btcapture.to_events(tail))
+        else:
+            self.recent.extend(packet_sources.capture_lines(filename))
+
+        return len(records)
+
+    #   A consumer for the lines one controller hears
+
+    def feeder(self, controller):
+        def consume(line):
+            return self.feed(line, controller)
+
+        return consume
+
+    #   Keep the advertising event for the capture file
+
+    def record_event(self, mac, hexes):
+        event = (
+            time.time(),
+            mac,
+            self.lastrssi.get(mac),
+            bytes.fromhex(" ".join(hexes)),
+        )
+        self.recent.append(event)
+        if self.capture is not None:
+            self.capture.write([event])
+
+    def add_rssi(self, mac, pwr, controller=None):
+        self.lastrssi[mac] = pwr
+        tables = [self.rssi]
+        if controller is not None:
+            tables.append(self.controllers.setdefault(controller, {}))
+
+        for table in tables:
+            stats = table.get(mac)
+            if stats is None:
+                table[mac] = [pwr, pwr, 1, pwr]
+            else:
+                stats[0] = min(stats[0], pwr)
+                stats[1] += pwr
+                stats[2] += 1
+                stats[3] = max(stats[3], pwr)
+
+    #   Has another controller just heard this same packet
+
+    def duplicate(self, controller, cutdown):
+        now = time.time()
+        mac = self.reversedMACs[cutdown[:17]]
+        key = (mac, cutdown)
+        last = self.lastheard.get(key)
+
+        if last is not None and last[0] != controller:
+            if now - last[1] < duplicateWindow:
+                self.duplicates += 1
+                runStats.count("duplicates")
+                return True
+
+        self.lastheard[key] = (controller, now)
+        return False
+
+    def add(self, datapoint):
+        self.matched += 1
+        runStats.sensor(datapoint[0], "packets")
+
+        #   Only range check implemented is on temperature
+
+        if not mintemp <= datapoint[2] <= maxtemp:
+            return
+        self.inrange += 1
+        runStats.sensor(datapoint[0], "inrange")
+
+        counters = self.readings.setdefault(datapoint[0], {})
+        sums = counters.get(datapoint[4])
+        if sums is not None and dedupPackets:
+            sums[4] += 1
+            return
+
+        median = self.medians.get(datapoint[0])
+        if median is None:
+            median = self.medians[datapoint[0]] = RunningMedian()
+        median.add(datapoint[4])
+
+        if sums is None:
+            counters[datapoint[4]] = [1, datapoint[1], datapoint[2], datapoint[3], 1]
+        else:
+            sums[0] += 1
+            sums[4] += 1
+            sums[1] += datapoint[1]
+            sums[2] += datapoint[2]
+            sums[3] += datapoint[3]
+
+        if 0 < samplesWanted and datapoint[0] not in self.satisfied:
+            if samplesWanted <= self.validated_count(datapoint[0]):
+                self.satisfied.add(datapoint[0])
+
+    #   How many samples for a MAC currently pass the counter window check
+
+    def validated_count(self, mac):
+        counters = self.readings.get(mac, {})
+        if {} == counters:
+            return 0
+        lowerbnd, upperbnd = self.window(mac)
+        return sum(
+            sums[0]
+            for counter, sums in counters.items()
+            if lowerbnd <= counter < upperbnd
+        )
+
+    #   Counter window centred on the median. These are quite wide limits.
+
+    def window(self, mac):
+        midpoint = self.medians[mac].median()
+        return int(midpoint - scantime), int(midpoint + scantime)
+
+    #   Distinct readings heard for a MAC and, of those passing the
+    #   counter window, an estimate of how many were missed
+
+    def losses(self, mac):
+        counters = self.readings.get(mac, {})
+        if {} == counters:
+            return 0, 0
+        lowerbnd, upperbnd = self.window(mac)
+        return len(counters), packet_loss(
+            [counter for counter in counters if lowerbnd <= counter < upperbnd]
+        )
+
+    #   Adaptive scan: has every sensor we expect got enough samples?
+
+    def complete(self):
+        if samplesWanted <= 0:
+            return False
+        expected = set(MACLocations) | set(self.thermometers)
+        return expected <= self.satisfied
+
+    #   Start again for the next daemon window. bluetoothctl only
+    #   announces a device once a session so keep the thermometers
+
+    def next_window(self):
+        self.rssi = {}
+        self.readings = {}
+        self.medians = {}
+        self.controllers = {}
+        self.lastheard = {}
+        self.duplicates = 0
+        self.matched = 0
+        self.inrange = 0
+        self.satisfied = set()
+
+    #   Why there's nothing to report, or None if there is
+
+    def problem(self):
+
+        if {} == self.thermometers:
+            return "No thermometers found"
+
+        if 0 == self.matched:
+            return "No temperature data in scan"
+
+        if 0 == self.inrange:
+            return "No data in range"
+
+        if {} == self.validate():
+            return "Data validation checks all fail"
+
+        return None
+
+    #   Use a window centred on the median to exclude
+    #   outliers.  These tend to be way off.
+    #   Done once the window is over rather than packet by packet, an
+    #   early packet can't be judged against a median still settling.
+    #   Returns totals {MAC: [count, volts, temp, humidity]}
+
+    def validate(self):
+        validated = {}
+        for mac, counters in self.readings.items():
+            lowerbnd, upperbnd = self.window(mac)
+
+            totals = [0.0, 0.0, 0.0, 0.0]
+            for counter, sums in counters.items():
+                if lowerbnd <= counter < upperbnd:
+                    for index in range(4):
+                        totals[index] += sums[index]
+            if totals[0] != 0.0:
+                validated[mac] = totals
+
+        return validated
+
+    #   Counter window check on what we've got then form averages
+
+    def summary(self):
+
+        problem = self.problem()
+        if problem is not None:
+            print(problem + "\n")
+            exit()
+
+        validated = self.validate()
+
+        results = []
+        failed = False
+        for mack in self.thermometers:
+            location = MACLocations.get(mack, mack)
+            items, pwr, temp, humid = validated.get(mack, [0.0, 0.0, 0.0, 0.0])
+            runStats.sensor(mack, "samples", int(items))
+            if dedupPackets and runStats.enabled:
+                distinct, lost = self.losses(mack)
+                runStats.sensor(mack, "distinct", distinct)
+                runStats.sensor(mack, "lost", lost)
+            if items == 0.0:
+                failed = True
+            results.append(sensor_result(location, items, pwr, temp, humid))
+
+        if failed:
+            if captureBinary:
+                btcapture.save(failCapture, self.recent)
+            else:
+                dump_failure(list(self.recent))
+
+        #   With several controllers each one's view is reported
+        #   as location@controller
+
+        rssi_stats = []
+        if findRssi:
+            tables = [("", self.rssi)]
+            if 1 < len(self.controllers):
+                tables = [
+                    ("@" + controller, table)
+                    for controller, table in sorted(self.controllers.items())
+                ]
+            for suffix, table in tables:
+                for therm in self.thermometers:
+                    stats = table.get(therm)
+                    if stats is not None:
+                        rssi_stats.append(
+                            (
+                                MACLocations.get(therm, therm) + suffix,
+                                round(stats[0], 2),
+                                round(stats[1] / stats[2], 2),
+                                round(stats[3], 2),
+                            )
+                        )
+
+        return results, rssi_stats
+
+
+#
+#   Timings and counts for a run (or a daemon window), see statsFile.
+#   Only kept if something wants them (statsFile or the metrics), the
+#   rest of the time NoStats takes their place and does nothing.
+#   noise_lines counts the lines thrown away as of no interest.
+#   Sensor counts are kept by MAC:
+#       packets     ManufacturerData records decoded
+#       inrange     of which passed the temperature range check
+#       distinct    of which were different readings (see dedupPackets)
+#       samples     of which passed the counter window check
+#       lost        readings estimated to have been missed
+#
+
+
+class RunStats:
+    enabled = True
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages = {}  # name -> seconds
+        self.counts = {}  # name -> count
+        self.sensors = {}  # MAC -> {name: count}
+
+    def add_time(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    #   Wrap consume so the time spent in it goes to a stage
+
+    def timed(self, name, consume):
+        def wrapper(line):
+            start = time.perf_counter()
+            try:
+                return consume(line)
+            finally:
+                self.add_time(name, time.perf_counter() - start)
+
+        return wrapper
+
+    def count(self, name, value=1):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def sensor(self, mac, name, value=1):
+        counts = self.sensors.setdefault(mac, {})
+        counts[name] = counts.get(name, 0) + value
+
+    def record(self):
+        sensors = {}
+        for mac, counts in self.sensors.items():
+            packets = counts.get("packets", 0)
+            inrange = counts.get("inrange", 0)
+            distinct = counts.get("distinct", inrange)
+            samples = counts.get("samples", 0)
+            sensor = {
+                "packets": packets,
+                "range_rejects": packets - inrange,
+                "counter_rejects": distinct - samples,
+                "samples": samples,
+            }
+            if "distinct" in counts:
+                sensor["repeats"] = inrange - distinct
+                sensor["lost"] = counts.get("lost", 0)
+            sensors[MACLocations.get(mac, mac)] = sensor
+
+        return {
+            "time": str(datetime.datetime.fromtimestamp(self.started)),
+            "seconds": round(time.time() - self.started, 3),
+            "stages": {name: round(taken, 6) for name, taken in self.stages.items()},
+            "counts": dict(self.counts),
+            "sensors": sensors,
+        }
+
+
+class NoStats(RunStats):
+    enabled = False
+
+    def add_time(self, name, seconds):
+        pass
+
+    def stage(self, name):
+        return contextlib.nullcontext()
+
+    def timed(self, name, consume):
+        return consume
+
+    def count(self, name, value=1):
+        pass
+
+    def sensor(self, mac, name, value=1):
+        pass
 
-    tidyList(DeviceScan)
+    def record(self):
+        return None
 
-    #   Find the MACs corresponding to the thermoBeacon
-    #   The above loop means we search for UPPER case thermoBeacon
-    #   and all thats left in these records is the MAC
 
+def new_stats():
+    if statsFile == "" and metricsFile == "" and metricsPort == 0:
+        return NoStats()
+    return RunStats()
+
+
+runStats = new_stats()
+
+
+def write_stats():
+    if statsFile == "":
+        return
+
+    record = json.dumps(runStats.record(), sort_keys=True)
+    if statsFile == "-":
+        print("Stats:", record)
+    else:
+        with open(statsFile, "a") as handle:
+            handle.write(record + "\n")
+
+
+#
+#   Batch decode: trawl through a whole scan at once.
+#   Done in stages, each a function of its own so they can be
+#   timed separately (see benchmark.py)
+#
+#   One pass through the scan sorting the lines (see btlexer.py)
+#   into thermometers announcing themselves, signal strengths and
+#   lines of hex data
+#
+
+
+def classify_scan(DeviceScan):
     thermometers = []
-    for index, elem in enumerate(DeviceScan):
-        if "THERMOBEACON" in elem:
-            nocrud = DeviceScan[index]
-            nocrud = nocrud.replace(" ", "")
-            nocrud = nocrud.replace("DEVICE", "")
-            nocrud = nocrud.replace("THERMOBEACON", "")
-            thermometers.append(nocrud)
+    thermometerRSSI = []
+    hexlines = []
+
+    for elem in DeviceScan:
+        event = btlexer.lex(elem)
+
+        if event.kind == btlexer.NOISE:
+            runStats.count("noise_lines")
+
+        elif is_thermometer(event):
+            runStats.count("announcements")
+            thermometers.append(event.mac)
+
+        #   Save a list of MAC's and pwr levels. Which are
+        #   thermometers we only know at the end
+
+        elif event.kind == btlexer.RSSI:
+            runStats.count("rssi_lines")
+            if findRssi:
+                thermometerRSSI.append((event.mac, event.value))
+
+        elif event.kind == btlexer.DATA:
+            if len(event.value) >= 14:
+                hexlines.append(event.value)
 
     #   Remove duplicates
 
     thermometers = list(dict.fromkeys(thermometers))
 
-    if [] == thermometers:
-        print("No thermometers found\n")
-        exit()
+    runStats.count("lines_read", len(DeviceScan))
+    runStats.count("hex_lines", len(hexlines))
 
-    #   Find rssi data for our thermometers
+    return thermometers, thermometerRSSI, hexlines
 
-    thermometerRSSI = []
 
-    #
-    #   This logical supresses the RSSI logging since its of little
-    #   use once satisfactory locations have been found for the devices
+#   min, mean and max RSSI for each thermometer that has any
 
-    if findRssi:
 
-        #   Find RSSI records
-        #   Save a list of MAC's and pwr levels
+def rssi_summary(thermometers, thermometerRSSI):
+    rssi_stats = []
 
-        for index, elem in enumerate(DeviceScan):
-            record = tidy(elem)
-            if "RSSI" in record:
-                comp = record.split()
+    # Get a list of pwr levels for each thermometer MAC in turn
 
-                # if its a MAC of interest i.e. belongs to a thermometer
-                # save it away
+    pwrlists = {therm: [] for therm in thermometers}
+    for pwr in thermometerRSSI:
+        if pwr[0] in pwrlists:
+            pwrlists[pwr[0]].append(pwr[1])
 
-                if comp[1] in thermometers:
-                    # Save MAC and pwr level converted to integer
-                    RSSI = (comp[1], int(comp[3]))
-                    thermometerRSSI.append(RSSI)
+    for therm, pwrs in pwrlists.items():
 
-        # Get a list of pwr levels for each thermometer MAC in turn
+        # Now get min max and average RSSI for each MAC and save
 
-        rssi_stats = []
-        for therm in thermometers:
-            pwrs = []
-            for pwr in thermometerRSSI:
-                if therm == pwr[0]:
-                    pwrs.append(pwr[1])
+        if pwrs != []:
+            # convert from mac to easy recognised name if possible
+            location = MACLocations.get(therm, therm)
 
-            # Now get min max and average RSSI for each MAC and save
+            #   save mac and rssi stats
 
-            if pwrs != []:
-                # convert from mac to easy recognised name if possible
-                location = MACLocations.get(therm, therm)
+            pwrstats = (
+                location,
+                round(min(pwrs), 2),
+                round(mean(pwrs), 2),
+                round(max(pwrs), 2),
+            )
+            rssi_stats.append(pwrstats)
 
-                #   save mac and rssi stats
+    return rssi_stats
 
-                pwrstats = (
-                    location,
-                    round(min(pwrs), 2),
-                    round(mean(pwrs), 2),
-                    round(max(pwrs), 2),
-                )
-                rssi_stats.append(pwrstats)
 
-    #
-    #   The manufacturer data record has in it the MAC
-    #   reversed so we need to produce a list of these
+#
+#   The manufacturer data record has in it the MAC
+#   reversed so we need to produce a table of these.
+#   Find records with reversed MAC's in them
+#   should also say manufacturerdata but this looks sufficient
+#   to identify them. Cut everything prior to the reversed MAC
+#
 
-    reversedMAC = []
 
+def match_macs(thermometers, hexlines):
+    reversedMACs = {}
     for mac in thermometers:
-        decomp = mac.split(":")
-        if len(decomp) == 6:
-            rev = (
-                decomp[5]
-                + " "
-                + decomp[4]
-                + " "
-                + decomp[3]
-                + " "
-                + decomp[2]
-                + " "
-                + decomp[1]
-                + " "
-                + decomp[0]
-            )
-            reversedMAC.append(rev)
-
-    #
-    #   Find records with reversed MAC's in them
-    #   should also say manufacturerdata but this looks sufficient
-    #   to identify them
+        ribit = reverse_mac(mac)
+        if ribit is not None:
+            reversedMACs[ribit] = mac
 
     dataforMAC = []
-    for ribit in reversedMAC:
-        for elem in DeviceScan:
-            #            print("A candidate record that may include a reversed MAC",elem)
-            #            print("search it for",ribit)
-            if ribit in elem:
-                #                print("A record that includes a reversed MAC",elem)
-                # Remove everything prior to the reversed MAC
-                # This varies and is best eliminated
-
-                cutdown = elem[elem.index(ribit) :]
-                dataforMAC.append(cutdown)
+    for hexes in hexlines:
+        cutdown = find_reversed_mac(hexes, reversedMACs)
+        if cutdown is not None:
+            dataforMAC.append(cutdown)
 
-    if [] == dataforMAC:
-        print("No temperature data in scan\n")
-        exit()
-    #
-    #   Now to interpret the data
-    #
+    return dataforMAC
 
-    datapoint = [0, 0, 0, 0, 0]
 
-    datums = []
+#
+#   Only range check implemented is on temperature
+#   could add humidity
+#   data order is MAC,battery Voltage,Temperature,humidity and time
+#
 
-    for index, elem in enumerate(dataforMAC):
-        nocrud = elem
-        datapoint = interpret(nocrud, False)
-        datums.append(datapoint)
-    #
-    #   Only range check implemented is on temperature
-    #   could add humidity
-    #   data order is MAC,battery Voltage,Temperature,humidity and time
 
-    range_checked = []
-    for elem in datums:
-        if mintemp <= elem[2] <= maxtemp:
-            range_checked.append(elem)
+def range_check(datums):
+    inrange = datums[(mintemp <= datums["temp"]) & (datums["temp"] <= maxtemp)]
+    return decoded_lists(inrange)
 
-    if [] == range_checked:
-        print("No data in range\n")
-        exit()
 
-    #
-    #   Sanity check on the timer values
-    #
-    # Use a window centred on the median to exclude
-    # outliers.  These tend to be way off.
+#
+#   One sample per (MAC, counter), the first heard, since a thermometer
+#   sends the same packet over and over until its counter moves on.
+#   Returns the samples and {(MAC, counter): times heard}
+#
+
+
+def deduplicate(range_checked):
+    unique = []
+    repeats = {}
+    for dats in range_checked:
+        key = (dats[0], dats[4])
+        if key in repeats:
+            repeats[key] += 1
+        else:
+            repeats[key] = 1
+            unique.append(dats)
+
+    return unique, repeats
+
+
+#
+#   Packets missed, going by the gaps in a thermometer's counters.
+#   Readings normally come a steady number of counts apart (the median
+#   gap) so a gap of n times that is n - 1 readings not heard
+#
 
+
+def packet_loss(counters):
+    if len(counters) < 3:
+        return 0
+    gaps = numpy.diff(numpy.sort(numpy.asarray(counters, dtype=numpy.float64)))
+    usual = numpy.median(gaps)
+    if usual <= 0.0:
+        return 0
+    return int(numpy.maximum(numpy.rint(gaps / usual) - 1, 0).sum())
+
+
+#
+#   Sanity check on the timer values
+#
+# Use a window centred on the median to exclude
+# outliers.  These tend to be way off.
+
+
+def counter_check(thermometers, range_checked):
     range_checked = sorted(range_checked)
 
-    # Save all the counter values associated
-    # with a given mac as  [mac,[counter values...]]
+    # Median of the counter values for each MAC, in one pass
 
-    timelist = []
-    for therm in thermometers:
-        timesr = []
-        for dats in range_checked:
-            if therm == dats[0]:
-                timesr.append(dats[4])
-        timelist.append([therm, timesr])
+    medians = {therm: RunningMedian() for therm in thermometers}
+    for dats in range_checked:
+        medians[dats[0]].add(dats[4])
 
-    #    print(timelist)
-    # Now form statistics on the counter list
     # Save dictionary items mac -> bounds
 
     macrangelimits = {}
-    for item in timelist:
-        mac = item[0]
-        times = item[1]
-        if times != []:
-            midpoint = statistics.median(times)
-        else:
-            midpoint = 0.0  # if no data the midpoint is arbitrary
-            continue
+    for mac, median in medians.items():
+        if median.total == 0:
+            continue  # if no data the midpoint is arbitrary
+        midpoint = median.median()
 
         #   These are quite wide limits. one might expect scantime/2.0
         #   The behaviour of this code
@@ -478,28 +1295,29 @@ def main():
 
         lowerbnd = int(midpoint - scantime)
         upperbnd = int(midpoint + scantime)
-        upperlimit = max(times)
-        lowerlimit = min(times)
         macrangelimits.update({mac: (lowerbnd, upperbnd)})
 
     # Now (counter) range check the data in the temperature
-    # range checked data in range_checked
-    # if dats[4] in range(lowerbnd, upperbnd):
+    # range checked data in range_checked. Counters are whole numbers
+    # so this is the same as dats[4] in range(lowerbnd, upperbnd)
 
     validated = []
     for dats in range_checked:
         limits = macrangelimits.get(dats[0])
-        if dats[4] in range(limits[0], limits[1]):
+        if limits[0] <= dats[4] < limits[1]:
             validated.append(dats)
 
-    if [] == validated:
-        print("Data validation checks all fail\n")
-        exit()
+    return validated
+
+
+#   data order is MAC,battery Voltage,Temperature,humidity and time
+#   Find average readings. Returns the results and whether a
+#   thermometer had nothing that passed
 
-    #   data order is MAC,battery Voltage,Temperature,humidity and time
-    #   Find average readings
 
+def average(thermometers, validated):
     results = []
+    failed = False
     for mack in thermometers:
         #       Convert MAC to more human friendly reference
         location = MACLocations.get(mack, mack)
@@ -519,40 +1337,100 @@ def main():
                 humid += elem[3]
                 items += 1.0
 
-        #   if no data provide obviously incorrect data
-        #   want to have same output format as usual
-        failed = False
-        if items == 0.0:
-            failed = True
-            results.append((location, 0.0, -273.15, 100.0, -1, -1, -1))
-        else:
-            # Form averages
-            pwr = pwr / items
-            temp = temp / items
-            humid = humid / items
-            # from which we determine these
-            vpd_point = vpd_calc.vpd(temp, humid)
-            dew_point = vpd_calc.dew(temp, humid)
-            heat_index = vpd_calc.heat_index(temp, humid)
-
-            # 	save results to two dp
-
-            results.append(
-                (
-                    location,
-                    round(temp, 2),
-                    round(humid, 2),
-                    round(vpd_point, 2),
-                    round(dew_point, 2),
-                    round(heat_index, 2),
-                    round(pwr, 2),
-                )
-            )
+        failed = failed or items == 0.0
+        results.append(sensor_result(location, items, pwr, temp, humid))
+
+    return results, failed
+
+
+def decode_scan(DeviceScan):
+
+    with runStats.stage("classify"):
+        thermometers, thermometerRSSI, hexlines = classify_scan(DeviceScan)
+
+    if [] == thermometers:
+        print("No thermometers found\n")
+        exit()
+
+    #
+    #   This logical supresses the RSSI logging since its of little
+    #   use once satisfactory locations have been found for the devices
+
+    rssi_stats = []
+    if findRssi:
+        with runStats.stage("rssi"):
+            rssi_stats = rssi_summary(thermometers, thermometerRSSI)
+
+    with runStats.stage("match"):
+        dataforMAC = match_macs(thermometers, hexlines)
+
+    if [] == dataforMAC:
+        print("No temperature data in scan\n")
+        exit()
+    #
+    #   Now to interpret the data, all in one go
+    #
+
+    with runStats.stage("decode"):
+        datums = decode_batch(dataforMAC)
+    tally_macs(datums["mac"].tolist(), "packets")
+
+    with runStats.stage("range_check"):
+        range_checked = range_check(datums)
+    tally_macs((btcapture.mac_number(dats[0]) for dats in range_checked), "inrange")
+
+    if [] == range_checked:
+        print("No data in range\n")
+        exit()
+
+    if dedupPackets:
+        with runStats.stage("dedup"):
+            range_checked, repeats = deduplicate(range_checked)
+        tally_macs(
+            (btcapture.mac_number(dats[0]) for dats in range_checked), "distinct"
+        )
+
+    with runStats.stage("counter_check"):
+        validated = counter_check(thermometers, range_checked)
+    tally_macs((btcapture.mac_number(dats[0]) for dats in validated), "samples")
+
+    if dedupPackets and runStats.enabled:
+        for mac in thermometers:
+            counters = [dats[4] for dats in validated if dats[0] == mac]
+            runStats.sensor(mac, "lost", packet_loss(counters))
+
+    if [] == validated:
+        print("Data validation checks all fail\n")
+        exit()
+
+    with runStats.stage("average"):
+        results, failed = average(thermometers, validated)
 
     if failed:
-        handle = open(faildata, "wb")
-        pickle.dump(DeviceScan, handle)
-        handle.close()
+        dump_failure(DeviceScan)
+
+    return results, rssi_stats
+
+
+#   Count records per sensor for the stats, given their MACs as numbers
+
+
+def tally_macs(macs, name):
+    if not runStats.enabled:
+        return
+
+    counts = {}
+    for mac in macs:
+        counts[mac] = counts.get(mac, 0) + 1
+    for mac, count in counts.items():
+        runStats.sensor(btcapture.mac_name(mac), name, count)
+
+
+#   Report what we found. for each sensor
+# Sensor,temperature,humidity,vpd,dew pt,heat index,Battery voltage
+
+
+def report(results, rssi_stats):
 
     #   If asked to find signal strengths
 
@@ -561,14 +1439,207 @@ def main():
         if rssi_stats != []:
             print("Signal strength:", sorted(rssi_stats))
 
-    #  for each sensor report
-    # Sensor,temperature,humidity,vpd,dew pt,heat index,Battery voltage
-
     when = datetime.datetime.now()
     print(when, " Data:", sorted(results))
 
+    if storeDirectory != "":
+        logstore.append(storeDirectory, when, sorted(results))
+
+    publish(when, results, rssi_stats)
+
+
+#   Latest readings to the metrics exporter and/or file, if wanted
+
+metricsServer = None
+
+
+def publish(when, results, rssi_stats):
+    if metricsServer is None and metricsFile == "":
+        return
+
+    text = exporter.format_metrics(
+        results, rssi_stats, runStats.record(), when.timestamp()
+    )
+
+    if metricsServer is not None:
+        metricsServer.update(text)
+    if metricsFile != "":
+        exporter.write_textfile(metricsFile, text)
+
+
+#
+#   main thread...
+#
+#
+
+
+#
+#   Is the scan a saved capture, replayed flat out? Then its records
+#   can be decoded all together without going through bluetoothctl's lines
+
+
+def replaying_capture():
+    if packetSource == "replay" or (packetSource == "" and loadTestData):
+        return btcapture.is_capture(dataLoadFile)
+    return False
+
+
+def main():
+
+    #
+    #   Get raw data, either decoding as it arrives
+    #   or buffering it all and trawling through it afterwards
+    #
+
+    #   Stats are written however the run ends, exit() included.
+    #   When streaming, collect includes the time spent in decode
+
+    try:
+        if 1 < len(controllerMACs):
+            scan = ScanAggregator()
+            with runStats.stage("collect"):
+                lines = asyncio.run(
+                    packet_sources.collect_all(
+                        [make_source(controller) for controller in controllerMACs],
+                        [
+                            runStats.timed("decode", scan.feeder(controller))
+                            for controller in controllerMACs
+                        ],
+                        scantime,
+                    )
+                )
+            if 0 == sum(lines):
+                print("Data collection failed\n")
+                exit()
+            with runStats.stage("summary"):
+                results, rssi_stats = scan.summary()
+        elif replaying_capture():
+            scan = ScanAggregator()
+            with runStats.stage("decode"):
+                if 0 == scan.feed_capture(dataLoadFile):
+                    print("Data collection failed\n")
+                    exit()
+            with runStats.stage("summary"):
+                results, rssi_stats = scan.summary()
+        elif packetSource != "":
+            scan = ScanAggregator()
+            feed = runStats.timed("decode", scan.feed)
+            with runStats.stage("collect"):
+                lines = asyncio.run(
+                    packet_sources.collect(make_source(), feed, scantime)
+                )
+            if 0 == lines:
+                print("Data collection failed\n")
+                exit()
+            with runStats.stage("summary"):
+                results, rssi_stats = scan.summary()
+        elif streamDecode:
+            scan = ScanAggregator()
+            if saveTestData and captureBinary:
+                scan.capture = btcapture.CaptureWriter(captureFile)
+            with runStats.stage("collect"):
+                collect_data(controllerMAC, runStats.timed("decode", scan.feed))
+            with runStats.stage("summary"):
+                results, rssi_stats = scan.summary()
+        else:
+            with runStats.stage("collect"):
+                DeviceScan = collect_data(controllerMAC)
+            results, rssi_stats = decode_scan(DeviceScan)
+
+        report(results, rssi_stats)
+    finally:
+        write_stats()
+
+
+#
+#   Daemon mode. Keep scanning and report every interval seconds
+#   Process startup and controller setup only happen once
+#
+
+
+def emit(scan):
+    problem = scan.problem()
+    if problem is None:
+        #   A short window can be dominated by rogue packets
+        #   e.g. zero humidity which the dew point can't cope with.
+        #   Don't let that bring the daemon down.
+        try:
+            results, rssi_stats = scan.summary()
+            report(results, rssi_stats)
+        except ValueError:
+            print("Data validation checks all fail\n")
+    else:
+        print(problem + "\n")
+
+    write_stats()
+
+    # Output is normally redirected to the log so don't sit on it
+
+    sys.stdout.flush()
+
+
+def daemon(interval):
+    global runStats, metricsServer
+
+    if metricsPort != 0:
+        metricsServer = exporter.Exporter(metricsPort, metricsAddress)
+
+    scan = ScanAggregator()
+    emit_at = time.time() + interval
+
+    while True:
+        child = None
+        try:
+            child = start_scan(controllerMAC)
+            child.timeout = 1.0  # so quiet periods don't hold up reporting
+
+            while child.isalive():
+                try:
+                    line = child.readline()
+                    with runStats.stage("decode"):
+                        scan.feed(line)
+                except pexpect.TIMEOUT:
+                    pass
+
+                if emit_at <= time.time():
+                    emit(scan)
+                    scan.next_window()
+                    runStats = new_stats()
+                    emit_at = time.time() + interval
+
+        #   Wrong controller, dongle pulled out, bluetoothctl died...
+        #   Tidy up and have another go shortly
+
+        except pexpect.ExceptionPexpect:
+            pass
+
+        if child is not None:
+            child.close(force=True)
+
+        print("Data collection failed\n")
+        sys.stdout.flush()
+        time.sleep(restartDelay)
+
+
+def usage():
+    print("Usage: thermoBeacon.py [--daemon [seconds between reports]]")
+
 
 # 	The usual entry point stuff...
 
 if __name__ == "__main__":
-    main()
+    args = sys.argv[1:]
+
+    if [] == args:
+        main()
+    elif args[0] == "--daemon" and len(args) <= 2:
+        interval = emitInterval
+        if len(args) == 2:
+            try:
+                interval = float(args[1])
+            except ValueError:
+                usage()
+                exit()
+        daemon(interval)
+    else:
+        usage()
@@ -12,9 +12,21 @@
    t=16.63 rh=62.6 -> 0.71kPa vpd dp=9.31
    t=4.44 rh=81.0  -> 0,15KPa vpd dp=1.56
    (Read from the sensor app)
+
+   derived() does all three for numpy arrays of temperature
+   and humidity in one go, for working them out from raw data.
+
+   The sensors only report to 1/16 of a degree and of a percent
+   so lookup() can instead pick all three out of a table made
+   (once) for every reading they can give, optionally kept in
+   a file. Check the table against the functions above with
+       python3 vpd_calc.py [tablefile]
 """
 
+import os
+import sys
 import math
+import numpy
 
 
 def vpd(t, rh):
@@ -80,3 +92,184 @@ def heat_index(t, rh):
     hi = t - 1.0799 * math.exp(0.03755 * t) * (1.0 - math.exp(0.0801 * (d - 14.0)))
 
     return hi
+
+
+#   Array versions
+
+
+def derived(t, rh):
+    """
+
+    vpd, dew point and heat index for whole arrays of temperature
+    and relative humidity at once, the same sums as the functions
+    above but working out the shared terms only once.
+    Where rh <= 0 the dew point (and so the heat index) has no
+    meaning and comes back as NaN rather than raising an error.
+    Returns the three as arrays.
+
+    """
+
+    t = numpy.asarray(t, dtype=numpy.float64)
+    rh = numpy.asarray(rh, dtype=numpy.float64)
+
+    svp = 610.78 * numpy.exp((t / (t + 237.3)) * 17.2694)
+    vpd = svp * (1.0 - (rh / 100.0)) / 1000.0
+
+    alpha = 17.271
+    beta = 237.7
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        term = (alpha * t) / (beta + t)
+        rhterm = numpy.log(numpy.where(rh > 0.0, rh, numpy.nan) / 100.0)
+        dp = beta * (rhterm + term) / (alpha - rhterm - term)
+
+    hi = t - 1.0799 * numpy.exp(0.03755 * t) * (1.0 - numpy.exp(0.0801 * (dp - 14.0)))
+
+    return vpd, dp, hi
+
+
+def vpd_array(t, rh):
+    """vpd() for arrays"""
+    return derived(t, rh)[0]
+
+
+def dew_array(t, rh):
+    """dew() for arrays, NaN where rh <= 0"""
+    return derived(t, rh)[1]
+
+
+def heat_index_array(t, rh):
+    """heat_index() for arrays, NaN where rh <= 0"""
+    return derived(t, rh)[2]
+
+
+#   Lookup table at the sensors' resolution
+
+RESOLUTION = 16  # steps per degree and per percent, as thermoBeacon scaling
+TEMPRANGE = (-20.0, 65.0)  # the sensors' range, as thermoBeacon mintemp/maxtemp
+RHRANGE = (0.0, 100.0)
+
+#   Built (or loaded) on first use. vpd, dew point and heat index
+#   stacked, indexed by temperature step then humidity step
+
+table = None
+
+
+def grid():
+    """Every temperature and humidity the sensors can report, as arrays"""
+    t = numpy.arange(TEMPRANGE[0] * RESOLUTION, TEMPRANGE[1] * RESOLUTION + 1)
+    rh = numpy.arange(RHRANGE[0] * RESOLUTION, RHRANGE[1] * RESOLUTION + 1)
+    return t / RESOLUTION, rh / RESOLUTION
+
+
+def lookup_table(filename=None):
+    """
+
+    The table, worked out with derived() the first time it's wanted.
+    Single precision, which is plenty for values reported to two
+    decimal places and keeps it to 26MB.
+    Given a filename the table is read from there, memory mapped, if
+    it's been saved before and saved there if not.
+
+    """
+
+    global table
+
+    if table is not None:
+        return table
+
+    t, rh = grid()
+    shape = (3, len(t), len(rh))
+
+    if filename is not None:
+        try:
+            saved = numpy.load(filename, mmap_mode="r")
+            if saved.shape == shape and saved.dtype == numpy.float32:
+                table = saved
+                return table
+        except (OSError, ValueError):
+            pass
+
+    table = numpy.stack(derived(t[:, None], rh[None, :])).astype(numpy.float32)
+
+    if filename is not None:
+        temporary = filename + ".tmp"
+        with open(temporary, "wb") as handle:
+            numpy.save(handle, table)
+        os.replace(temporary, filename)
+
+    return table
+
+
+def lookup(t, rh, filename=None):
+    """
+
+    vpd, dew point and heat index as derived() gives them but looked
+    up in the table, temperature and humidity being taken to the
+    nearest 1/16. Anything outside the table is worked out as before.
+    filename as lookup_table().
+
+    """
+
+    t, rh = numpy.broadcast_arrays(
+        numpy.asarray(t, dtype=numpy.float64), numpy.asarray(rh, dtype=numpy.float64)
+    )
+
+    inside = (TEMPRANGE[0] <= t) & (t <= TEMPRANGE[1])
+    inside &= (RHRANGE[0] <= rh) & (rh <= RHRANGE[1])  # and not NaN
+
+    row = numpy.rint((numpy.where(inside, t, TEMPRANGE[0]) - TEMPRANGE[0]) * RESOLUTION)
+    column = numpy.rint((numpy.where(inside, rh, RHRANGE[0]) - RHRANGE[0]) * RESOLUTION)
+
+    shape = t.shape
+    t, rh, inside = numpy.atleast_1d(t, rh, inside)
+    row = numpy.atleast_1d(row).astype(numpy.intp)
+    column = numpy.atleast_1d(column).astype(numpy.intp)
+
+    found = lookup_table(filename)[:, row, column].astype(numpy.float64)
+
+    if not inside.all():
+        outside = ~inside
+        for index, values in enumerate(derived(t[outside], rh[outside])):
+            found[index][outside] = values
+
+    return tuple(values.reshape(shape) for values in found)
+
+
+def check_table(filename=None, every=1):
+    """
+
+    Largest difference between the table and vpd(), dew() and
+    heat_index() over every every'th temperature and humidity
+    (humidity 0 left out, the scalar sums can't do it).
+    Returns the three differences.
+
+    """
+
+    found = lookup_table(filename)
+    t, rh = grid()
+    worst = [0.0, 0.0, 0.0]
+
+    for row in range(0, len(t), every):
+        for column in range(max(every, 1), len(rh), every):
+            expected = (
+                vpd(t[row], rh[column]),
+                dew(t[row], rh[column]),
+                heat_index(t[row], rh[column]),
+            )
+            for index in range(3):
+                difference = abs(float(found[index, row, column]) - expected[index])
+                worst[index] = max(worst[index], difference)
+
+    return worst
+
+
+if __name__ == "__main__":
+    if 2 < len(sys.argv):
+        print("Usage: vpd_calc.py [tablefile]")
+        exit()
+    filename = sys.argv[1] if len(sys.argv) == 2 else None
+    differences = check_table(filename)
+    print("Largest differences from the table:")
+    for name, difference in zip(["vpd", "dew point", "heat index"], differences):
+        print(name.ljust(12), difference)